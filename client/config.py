@@ -5,7 +5,9 @@ class ClientConfig:
     DEFAULT_HOST = "localhost"
     DEFAULT_TCP_PORT = 5050
     DEFAULT_UDP_PORT = 5051
-    BUFFER_SIZE = 4096
+    BUFFER_SIZE = 65536
+    SOCKET_BUFFER_SIZE = 1 << 20  # Kernel SO_SNDBUF/SO_RCVBUF request
+    UDP_BUSY_POLL_US = 0  # Linux SO_BUSY_POLL microseconds, 0 disables
     ENCODING = "utf-8"
     TIMEOUT = 10  # seconds
     
@@ -15,6 +17,7 @@ class ClientConfig:
             "host": os.getenv("CHAT_SERVER_HOST", cls.DEFAULT_HOST),
             "port": int(os.getenv("CHAT_SERVER_TCP_PORT", cls.DEFAULT_TCP_PORT)),
             "buffer_size": cls.BUFFER_SIZE,
+            "socket_buffer_size": cls.SOCKET_BUFFER_SIZE,
             "encoding": cls.ENCODING,
             "timeout": cls.TIMEOUT
         }
@@ -25,6 +28,8 @@ class ClientConfig:
             "host": os.getenv("CHAT_SERVER_HOST", cls.DEFAULT_HOST),
             "port": int(os.getenv("CHAT_SERVER_UDP_PORT", cls.DEFAULT_UDP_PORT)),
             "buffer_size": cls.BUFFER_SIZE,
+            "socket_buffer_size": cls.SOCKET_BUFFER_SIZE,
             "encoding": cls.ENCODING,
-            "timeout": cls.TIMEOUT
+            "timeout": cls.TIMEOUT,
+            "busy_poll_us": int(os.getenv("CHAT_UDP_BUSY_POLL_US", cls.UDP_BUSY_POLL_US))
         }
\ No newline at end of file
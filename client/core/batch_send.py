@@ -0,0 +1,90 @@
+import ctypes
+import errno
+import os
+import socket
+import struct
+import sys
+from functools import lru_cache
+from typing import List, Optional
+
+# Datagrams handed to the kernel per sendmmsg(2) call
+MAX_BATCH_SIZE = 64
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_char_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_char_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    """Resolve sendmmsg from libc, or None where it does not exist (macOS/Windows)"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        sendmmsg = ctypes.CDLL(None, use_errno=True).sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = _load_sendmmsg()
+SENDMMSG_AVAILABLE = _sendmmsg is not None
+
+
+@lru_cache(maxsize=1024)
+def pack_sockaddr_in(address) -> bytes:
+    """Build a struct sockaddr_in for a numeric IPv4 (host, port) pair"""
+    host, port = address[:2]
+    return struct.pack("=H", socket.AF_INET) + struct.pack(">H4s8x", port, socket.inet_aton(host))
+
+
+def send_batch(fd: int, payloads: List[bytes], addresses: Optional[List[bytes]] = None) -> int:
+    """Send datagrams with one sendmmsg call per MAX_BATCH_SIZE - returns how many were accepted
+
+    addresses holds packed sockaddr_in values, one per payload; leave it out on a
+    connected socket. A full send buffer just ends the batch early; other errors
+    raise OSError unless some datagrams already went out.
+    """
+    sent = 0
+    for start in range(0, len(payloads), MAX_BATCH_SIZE):
+        chunk = payloads[start:start + MAX_BATCH_SIZE]
+        iovecs = (_IOVec * len(chunk))()
+        messages = (_MMsgHdr * len(chunk))()
+        for i, payload in enumerate(chunk):
+            iovecs[i].iov_base = payload
+            iovecs[i].iov_len = len(payload)
+            header = messages[i].msg_hdr
+            if addresses is not None:
+                name = addresses[start + i]
+                header.msg_name = name
+                header.msg_namelen = len(name)
+            header.msg_iov = ctypes.pointer(iovecs[i])
+            header.msg_iovlen = 1
+
+        count = _sendmmsg(fd, messages, len(chunk), 0)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK) or sent:
+                return sent
+            raise OSError(error, os.strerror(error))
+        sent += count
+        if count < len(chunk):
+            break  # Send buffer full - the caller deals with the rest
+    return sent
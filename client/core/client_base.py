@@ -1,17 +1,27 @@
 from abc import ABC, abstractmethod
 import logging
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Default kernel send/receive buffer size requested for client sockets
+SOCKET_BUFFER_SIZE = 1 << 20
 
 class ClientBase(ABC):
     """Abstract base class for chat clients"""
     
-    def __init__(self, host, port, buffer_size=4096, encoding="utf-8", timeout=10):
+    def __init__(self, host, port, buffer_size=65536, encoding="utf-8", timeout=10,
+                 socket_buffer_size=SOCKET_BUFFER_SIZE):
         self.host = host
         self.port = port
         self.buffer_size = buffer_size
         self.encoding = encoding
         self.timeout = timeout
-        self.is_connected = False
-        self.logger = logging.getLogger(__name__)
+        self.socket_buffer_size = socket_buffer_size
+        # Shared between the caller and background threads
+        self._connected = threading.Event()
+        self.logger = logger
     
     @abstractmethod
     def connect(self):
@@ -33,6 +43,30 @@ class ClientBase(ABC):
         """Close connection"""
         pass
     
-    def is_connected(self):
+    @property
+    def is_connected(self) -> bool:
         """Check if client is connected"""
-        return self.is_connected
\ No newline at end of file
+        return self._connected.is_set()
+    
+    @is_connected.setter
+    def is_connected(self, value: bool):
+        if value:
+            self._connected.set()
+        else:
+            self._connected.clear()
+    
+    def _set_socket_buffers(self, sock: socket.socket):
+        """Request larger kernel send/receive buffers (the OS may clamp them)"""
+        if not self.socket_buffer_size:
+            return
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer_size)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer_size)
+        except OSError as e:
+            self.logger.debug(f"Could not resize socket buffers: {e}")
+            return
+        
+        # The kernel silently clamps to net.core.[rw]mem_max, so report what we got
+        sndbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self.logger.debug(f"Socket buffers: requested {self.socket_buffer_size}, got sndbuf={sndbuf} rcvbuf={rcvbuf}")
@@ -1,20 +1,110 @@
 import json
+import os
+import struct
 import time
 from dataclasses import dataclass
-from typing import Optional, Dict, Any
-from enum import Enum
+from functools import lru_cache, partialmethod
+from typing import Optional, Dict, Any, Union
+from enum import IntEnum
 
-class MessageType(Enum):
+try:
+    import orjson
+
+    # orjson returns bytes directly and parses bytes without a decode step
+    def _encode_record(type_name, content, timestamp, username, version) -> bytes:
+        return orjson.dumps({
+            "type": type_name,
+            "content": content,
+            "timestamp": timestamp,
+            "username": username,
+            "version": version
+        })
+
+    _loads = orjson.loads
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    # Only the free-text fields need escaping, so skip building a dict for json.dumps
+    _RECORD_TEMPLATE = '{"type":"%s","content":%s,"timestamp":%r,"username":%s,"version":%s}'
+
+    def _encode_record(type_name, content, timestamp, username, version) -> bytes:
+        return (_RECORD_TEMPLATE % (
+            type_name,
+            json.dumps(content),
+            timestamp,
+            json.dumps(username),
+            json.dumps(version)
+        )).encode("utf-8")
+
+    _loads = json.loads
+    _dumps = json.dumps
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# MessagePack framing is opt-in until the server speaks it too
+USE_MSGPACK = msgspec is not None and os.getenv("CHAT_WIRE_FORMAT", "json").lower() == "msgpack"
+
+if msgspec is not None:
+    class ChatMessageStruct(msgspec.Struct, array_like=True):
+        """Fixed-shape MessagePack record for ChatMessage (encoded as an array)"""
+        type: int
+        content: str
+        timestamp: float
+        username: Optional[str] = None
+        version: str = "1.0"
+
+    _MSGPACK_ENCODER = msgspec.msgpack.Encoder()
+    _MSGPACK_DECODER = msgspec.msgpack.Decoder(ChatMessageStruct)
+
+    class _JsonRecord(msgspec.Struct):
+        """Named JSON fields of a ChatMessage, decoded without building a dict"""
+        type: Union[int, str] = "message"
+        content: Any = ""
+        timestamp: Optional[float] = None
+        username: Any = None
+        version: Any = "1.0"
+
+    _JSON_DECODER = msgspec.json.Decoder(_JsonRecord)
+else:
+    _JSON_DECODER = None
+
+class MessageType(IntEnum):
     """Types of messages supported in the chat"""
-    CONNECT = "connect"
-    DISCONNECT = "disconnect" 
-    MESSAGE = "message"
-    STATUS = "status"
-    ERROR = "error"
-    TEST = "test"
-    ACK = "ack"
-
-@dataclass
+    CONNECT = 1
+    DISCONNECT = 2
+    MESSAGE = 3
+    STATUS = 4
+    ERROR = 5
+    TEST = 6
+    ACK = 7
+    
+    @classmethod
+    def from_wire(cls, value) -> 'MessageType':
+        """Accept the integer form or the legacy lowercase string form"""
+        if isinstance(value, int):
+            return cls(value)
+        try:
+            return _TYPES_BY_NAME[value]
+        except (KeyError, TypeError):
+            raise ValueError(f"Unknown message type: {value!r}") from None
+
+_WIRE_NAMES = {message_type: message_type.name.lower() for message_type in MessageType}
+_TYPES_BY_NAME = {name: message_type for message_type, name in _WIRE_NAMES.items()}
+
+# Big-endian 4-byte length prefix used to frame messages on stream sockets
+FRAME_HEADER = struct.Struct(">I")
+
+# Content templates for control messages that only carry the username
+_CONTROL_TEMPLATES = {
+    MessageType.CONNECT: "User {} connected",
+    MessageType.DISCONNECT: "User {} disconnected",
+}
+
+@dataclass(slots=True)
 class ChatMessage:
     """Message protocol for chat application - Compatible with server"""
     type: MessageType  # Use 'type' instead of 'message_type'
@@ -23,138 +113,179 @@ class ChatMessage:
     username: Optional[str] = None
     version: str = "1.0"  # Add version field
     
-    def to_json(self) -> str:
-        """Convert message to JSON string that matches server format"""
-        return json.dumps({
-            "type": self.type.value,  # Use .value for Enum
-            "content": self.content,
-            "timestamp": self.timestamp,
-            "username": self.username,
-            "version": self.version
-        })
+    _default_version = "1.0"
+    
+    def to_json(self) -> bytes:
+        """Convert message to UTF-8 encoded JSON that matches server format"""
+        return _encode_record(
+            _WIRE_NAMES[self.type],  # Server expects the string form
+            self.content,
+            self.timestamp,
+            self.username,
+            self.version
+        )
     
     @classmethod
-    def from_json(cls, json_str: str) -> 'ChatMessage':
-        """Create message from JSON string - handles reliable messages"""
+    def from_json(cls, json_str) -> 'ChatMessage':
+        """Create message from JSON bytes or string - handles reliable messages"""
         try:
-            data = json.loads(json_str)
+            if _JSON_DECODER is not None:
+                # msgspec fills the known fields straight from the bytes
+                record = _JSON_DECODER.decode(json_str)
+                type_value, content, timestamp = record.type, record.content, record.timestamp
+                username, version = record.username, record.version
+            else:
+                data = _loads(json_str)
+                type_value = data.get("type", "message")
+                content = data.get("content", "")
+                timestamp = data.get("timestamp")
+                username = data.get("username")
+                version = data.get("version", cls._default_version)
             
             # Convert string type to MessageType enum
-            message_type = MessageType(data.get("type", "message"))
-            content = data.get("content", "")
-            username = data.get("username")
+            message_type = MessageType.from_wire(type_value)
             
             # If it's a MESSAGE type, check if it has sequence data
             if message_type == MessageType.MESSAGE:
-                try:
-                    msg_data = json.loads(content)
-                    if "sequence" in msg_data and "data" in msg_data:
-                        # This is a reliable message, extract the actual content
-                        content = msg_data.get("data", "")
-                except (json.JSONDecodeError, TypeError):
-                    # Not a reliable message, use content as-is
-                    pass
+                content = cls._unwrap_reliable(content)
+            
+            # Only read the clock when the sender omitted the timestamp
+            if timestamp is None:
+                timestamp = time.time()
             
-            return cls(
-                type=message_type,
-                content=content,
-                timestamp=data.get("timestamp", time.time()),
-                username=username,
-                version=data.get("version", "1.0")
-            )
+            return cls(message_type, content, timestamp, username, version)
         except (json.JSONDecodeError, ValueError, KeyError):
             # Return error message if parsing fails
-            return cls(
-                type=MessageType.ERROR,
-                content="Invalid message format",
-                timestamp=time.time()
-            )
+            return cls._invalid_message()
+    
+    def encode(self) -> bytes:
+        """Serialize message using the configured wire format"""
+        if USE_MSGPACK:
+            return _MSGPACK_ENCODER.encode(ChatMessageStruct(
+                int(self.type),
+                self.content,
+                self.timestamp,
+                self.username,
+                self.version
+            ))
+        return self.to_json()
     
     @classmethod
-    def create_text_message(cls, content: str, username: str = None) -> 'ChatMessage':
-        """Create a text message"""
+    def decode(cls, data) -> 'ChatMessage':
+        """Create message from a frame in the configured wire format"""
+        if not USE_MSGPACK:
+            return cls.from_json(data)
+        
+        try:
+            record = _MSGPACK_DECODER.decode(data)
+            message_type = MessageType.from_wire(record.type)
+        except (msgspec.DecodeError, ValueError):
+            return cls._invalid_message()
+        
+        content = record.content
+        if message_type == MessageType.MESSAGE:
+            content = cls._unwrap_reliable(content)
+        
         return cls(
-            type=MessageType.MESSAGE,
+            type=message_type,
             content=content,
-            timestamp=time.time(),
-            username=username,
-            version="1.0"
+            timestamp=record.timestamp,
+            username=record.username,
+            version=record.version
         )
     
-    @classmethod
-    def create_connect_message(cls, username: str = None) -> 'ChatMessage':
-        """Create a connection message"""
-        return cls(
-            type=MessageType.CONNECT,
-            content=f"User {username} connected",
-            timestamp=time.time(),
-            username=username,
-            version="1.0"
-        )
+    @staticmethod
+    def _unwrap_reliable(content: str) -> str:
+        """Return the payload of a reliable message envelope, or content as-is"""
+        # Only a JSON object can be an envelope, so plain chat text is not parsed a
+        # second time; the keys are looked up after parsing, so their order doesn't matter
+        if not isinstance(content, str) or not content.startswith("{"):
+            return content
+        
+        try:
+            msg_data = _loads(content)
+            if "sequence" in msg_data and "data" in msg_data:
+                # This is a reliable message, extract the actual content
+                return msg_data.get("data", "")
+        except (json.JSONDecodeError, TypeError):
+            # Not a reliable message, use content as-is
+            pass
+        return content
     
     @classmethod
-    def create_disconnect_message(cls, username: str = None) -> 'ChatMessage':
-        """Create a disconnect message"""
+    def _invalid_message(cls) -> 'ChatMessage':
+        """Error message returned when a frame cannot be parsed"""
         return cls(
-            type=MessageType.DISCONNECT,
-            content=f"User {username} disconnected",
-            timestamp=time.time(),
-            username=username,
-            version="1.0"
+            type=MessageType.ERROR,
+            content="Invalid message format",
+            timestamp=time.time()
         )
     
     @classmethod
-    def create_status_message(cls, content: str, username: str = None) -> 'ChatMessage':
-        """Create a status message"""
+    def create(cls, message_type: MessageType, content: str, username: str = None,
+               timestamp: float = None) -> 'ChatMessage':
+        """Create a message of any type - timestamp defaults to now"""
         return cls(
-            type=MessageType.STATUS,
-            content=content,
-            timestamp=time.time(),
-            username=username,
-            version="1.0"
+            message_type,
+            content,
+            time.time() if timestamp is None else timestamp,
+            username,
+            cls._default_version
         )
     
     @classmethod
-    def create_error_message(cls, content: str, username: str = None) -> 'ChatMessage':
-        """Create an error message"""
-        return cls(
-            type=MessageType.ERROR,
-            content=content,
-            timestamp=time.time(),
-            username=username,
-            version="1.0"
-        )
+    def create_control_message(cls, message_type: MessageType, username: str = None,
+                               timestamp: float = None) -> 'ChatMessage':
+        """Create a connect/disconnect message from its content template"""
+        content = _CONTROL_TEMPLATES[message_type].format(username)
+        return cls.create(message_type, content, username, timestamp)
+    
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def encoded_control_message(message_type: MessageType, username: str = None) -> bytes:
+        """Encoded connect/disconnect frame for username, built once and reused
+        
+        The embedded timestamp is the one from the first encode.
+        """
+        return ChatMessage.create_control_message(message_type, username).encode()
+    
+    create_text_message = partialmethod(create, MessageType.MESSAGE)
+    create_status_message = partialmethod(create, MessageType.STATUS)
+    create_error_message = partialmethod(create, MessageType.ERROR)
+    create_connect_message = partialmethod(create_control_message, MessageType.CONNECT)
+    create_disconnect_message = partialmethod(create_control_message, MessageType.DISCONNECT)
     
     @classmethod
-    def create_ack_message(cls, sequence: int, test_id: str = None) -> 'ChatMessage':
-        """Create an acknowledgement message"""
-        content = json.dumps({"sequence": sequence})
+    def create_ack_message(cls, sequence: int, test_id: str = None,
+                           timestamp: float = None, ack: int = None,
+                           ack_bits: int = 0) -> 'ChatMessage':
+        """Create an acknowledgement message
+        
+        ack/ack_bits optionally carry the receive window (bit i of ack_bits marks
+        sequence ack - 1 - i as received).
+        """
+        ack_data = {"sequence": sequence}
         if test_id:
-            content = json.dumps({"sequence": sequence, "test_id": test_id})
+            ack_data["test_id"] = test_id
+        if ack is not None:
+            ack_data["ack"] = ack
+            ack_data["ack_bits"] = ack_bits
+        content = _dumps(ack_data)
         
-        return cls(
-            type=MessageType.ACK,
-            content=content,
-            timestamp=time.time(),
-            username="server",  # Server sends ACKs
-            version="1.0"
-        )
+        # Server sends ACKs
+        return cls.create(MessageType.ACK, content, "server", timestamp)
 
     # Add this method to ChatMessage class
     @classmethod
     def create_reliable_message(cls, sequence: int, content: str, 
-                            username: str = None, test_id: str = None) -> 'ChatMessage':
+                            username: str = None, test_id: str = None,
+                            timestamp: float = None) -> 'ChatMessage':
         """Create a reliable message with sequence number (still MESSAGE type)"""
-        enhanced_content = json.dumps({
+        enhanced_content = _dumps({
             "sequence": sequence,
             "data": content,
             "test_id": test_id
         })
         
-        return cls(
-            type=MessageType.MESSAGE,  # Still regular MESSAGE type
-            content=enhanced_content,
-            timestamp=time.time(),
-            username=username,
-            version="1.0"
-        )
\ No newline at end of file
+        # Still regular MESSAGE type
+        return cls.create(MessageType.MESSAGE, enhanced_content, username, timestamp)
@@ -1,37 +1,106 @@
 import threading
-import time
+import selectors
+import socket
 import logging
-from typing import Callable, Optional
-from .message_protocol import ChatMessage
+from typing import Callable
+from .message_protocol import ChatMessage, FRAME_HEADER
+
+logger = logging.getLogger(__name__)
 
 class ReceiverThread(threading.Thread):
-    """Dedicated thread for receiving messages"""
+    """Dedicated thread for receiving length-prefixed messages from a socket
+    
+    Waits for readiness with a selector, appends whatever is available to a
+    persistent buffer and dispatches every complete [4-byte len][body] frame.
+    """
     
-    def __init__(self, receive_function: Callable[[], Optional[ChatMessage]], 
+    def __init__(self, sock: socket.socket,
                  callback: Callable[[ChatMessage], None],
-                 check_interval: float = 0.1):
+                 read_size: int = 65536,
+                 max_message_size: int = 1024 * 1024):
         super().__init__(daemon=True)
-        self.receive_function = receive_function
+        self.sock = sock
         self.callback = callback
-        self.check_interval = check_interval
+        self.max_message_size = max_message_size
         self.should_run = True
-        self.logger = logging.getLogger(__name__)
+        self.logger = logger
+        
+        self._rxbuf = bytearray()
+        self._chunk = bytearray(read_size)
+        self._selector = selectors.DefaultSelector()
+        # Self-pipe so stop() can wake the selector without touching sock
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
     
     def run(self):
         """Main thread loop"""
         self.logger.info("Receiver thread started")
-        while self.should_run:
-            try:
-                message = self.receive_function()
-                if message and self.callback:
-                    self.callback(message)
-            except Exception as e:
+        self._selector.register(self.sock, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        try:
+            while self.should_run:
+                for key, _ in self._selector.select():
+                    if key.fileobj is self._wakeup_r or not self._read_available():
+                        self.should_run = False
+                        break
+        except OSError as e:
+            if self.should_run:
                 self.logger.error(f"Error in receiver thread: {e}")
-            
-            time.sleep(self.check_interval)
+        finally:
+            self._selector.close()
+            self._wakeup_r.close()
+            self._wakeup_w.close()
         
         self.logger.info("Receiver thread stopped")
     
+    def _read_available(self) -> bool:
+        """Read buffered data and dispatch complete frames - False once the peer closed"""
+        view = memoryview(self._chunk)
+        while True:
+            count = self.sock.recv_into(view)
+            if not count:
+                self.logger.debug("Peer closed connection")
+                return False
+            self._rxbuf += view[:count]
+            
+            # SSL sockets can hold decrypted bytes the selector cannot see
+            pending = getattr(self.sock, "pending", None)
+            if pending is None or not pending():
+                break
+        
+        self._dispatch_frames()
+        return True
+    
+    def _dispatch_frames(self):
+        """Decode every complete frame in the receive buffer"""
+        buffer = self._rxbuf
+        offset = 0
+        while len(buffer) - offset >= FRAME_HEADER.size:
+            message_len = FRAME_HEADER.unpack_from(buffer, offset)[0]
+            if message_len > self.max_message_size:
+                self.logger.error("Message too large — clearing buffer")
+                buffer.clear()
+                return
+            
+            start = offset + FRAME_HEADER.size
+            end = start + message_len
+            if len(buffer) < end:
+                break  # Wait for the rest of the frame
+            
+            message = ChatMessage.decode(buffer[start:end])
+            offset = end
+            if self.callback:
+                try:
+                    self.callback(message)
+                except Exception as e:
+                    self.logger.error(f"Error in receiver callback: {e}")
+        
+        if offset:
+            del buffer[:offset]
+    
     def stop(self):
         """Stop the receiver thread"""
-        self.should_run = False
\ No newline at end of file
+        self.should_run = False
+        try:
+            self._wakeup_w.send(b"\0")
+        except OSError:
+            pass  # Thread already exited and closed the pipe
@@ -1,28 +1,39 @@
+import selectors
 import socket
 import threading
 import time
 from typing import Callable, Optional
-from .client_base import ClientBase
-from .message_protocol import ChatMessage, MessageType
-import matplotlib.pyplot as plt
+from .client_base import ClientBase, SOCKET_BUFFER_SIZE
+from .message_protocol import ChatMessage, MessageType, FRAME_HEADER
 import ssl
 from pathlib import Path
 
+# Linux-only: acknowledge immediately instead of delaying ACKs (the kernel clears it again)
+TCP_QUICKACK = getattr(socket, "TCP_QUICKACK", None)
+
 
 class TCPClient(ClientBase):
     """TCP client implementation"""
     
-    def __init__(self, host, port, buffer_size=4096, encoding="utf-8", timeout=10):
-        super().__init__(host, port, buffer_size, encoding, timeout)
+    def __init__(self, host, port, buffer_size=65536, encoding="utf-8", timeout=10,
+                 socket_buffer_size=SOCKET_BUFFER_SIZE):
+        super().__init__(host, port, buffer_size, encoding, timeout, socket_buffer_size)
         self.socket = None
         self.ssl_context = None
         self.ssl_socket = None
         self.receive_callback = None
         self.receive_thread = None
         self.should_listen = False
+        self._wakeup_r = self._wakeup_w = None  # Self-pipe that interrupts the listener's select
         self.lock = threading.Lock()
         self.username = None
-        self._recv_buffer = b""
+        self.max_message_size = 1024 * 1024  # Frames larger than this are rejected
+        # Test receive buffer: frames are consumed by advancing _recv_head and the
+        # buffer is only compacted once the consumed prefix outgrows the live data
+        self._recv_buffer = bytearray()
+        self._recv_head = 0
+        self._recv_chunk = bytearray(buffer_size)
+        self._send_scratch = bytearray(buffer_size)  # Reused by _send_frame, guarded by lock
         
         # Setup SSL context
         self._setup_ssl_context()
@@ -60,6 +71,10 @@ class TCPClient(ClientBase):
         try:
             # Create plain TCP socket
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Disable Nagle: chat frames are small and latency-sensitive
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._enable_quickack(self.socket)
+            self._set_socket_buffers(self.socket)
             self.socket.settimeout(self.timeout)
             
             # Connect to server
@@ -84,6 +99,8 @@ class TCPClient(ClientBase):
                 self.ssl_socket = self.socket
                 self.logger.warning("SSL context not available, using plain TCP")
             
+            # Block in recv() until data arrives instead of polling
+            self.ssl_socket.settimeout(None)
             self.is_connected = True
             return True
             
@@ -113,15 +130,10 @@ class TCPClient(ClientBase):
         
         try:
             chat_message = ChatMessage.create_text_message(message, username)
-            message_data = chat_message.to_json().encode(self.encoding)
-            
-            # Send message length first (4 bytes)
-            message_len = len(message_data)
-            self.ssl_socket.sendall(message_len.to_bytes(4, byteorder='big'))
+            message_data = chat_message.encode()
             
-            # Send actual message
-            self.ssl_socket.sendall(message_data)
-            self.logger.debug(f"Encrypted message sent: {message}")
+            self._send_frame(message_data)
+            self.logger.debug("Encrypted message sent: %s", message)
             return True
         except ssl.SSLError as e:
             self.logger.error(f"SSL error sending message: {e}")
@@ -132,6 +144,19 @@ class TCPClient(ClientBase):
             self.is_connected = False
             return False
     
+    def _send_frame(self, payload: bytes):
+        """Send 4-byte length prefix and payload in a single write
+        
+        The frame is assembled in a reusable scratch buffer instead of a new bytes object.
+        """
+        frame_len = FRAME_HEADER.size + len(payload)
+        with self.lock:
+            if len(self._send_scratch) < frame_len:
+                self._send_scratch = bytearray(frame_len)
+            FRAME_HEADER.pack_into(self._send_scratch, 0, len(payload))
+            self._send_scratch[FRAME_HEADER.size:frame_len] = payload
+            self.ssl_socket.sendall(memoryview(self._send_scratch)[:frame_len])
+    
     def send_connect_message(self, username: str) -> bool:
         """Send connection message with SSL"""
         if not self.is_connected or not self.ssl_socket:
@@ -139,12 +164,8 @@ class TCPClient(ClientBase):
         
         try:
             self.username = username
-            chat_message = ChatMessage.create_connect_message(username)
-            message_data = chat_message.to_json().encode(self.encoding)
-            
-            message_len = len(message_data)
-            self.ssl_socket.sendall(message_len.to_bytes(4, byteorder='big'))
-            self.ssl_socket.sendall(message_data)
+            message_data = ChatMessage.encoded_control_message(MessageType.CONNECT, username)
+            self._send_frame(message_data)
             
             self.logger.info(f"Sent encrypted connect message for user: {username}")
             return True
@@ -161,12 +182,8 @@ class TCPClient(ClientBase):
             return False
         
         try:
-            chat_message = ChatMessage.create_disconnect_message(self.username)
-            message_data = chat_message.to_json().encode(self.encoding)
-            
-            message_len = len(message_data)
-            self.ssl_socket.sendall(message_len.to_bytes(4, byteorder='big'))
-            self.ssl_socket.sendall(message_data)
+            message_data = ChatMessage.encoded_control_message(MessageType.DISCONNECT, self.username)
+            self._send_frame(message_data)
             
             self.logger.info("Sent encrypted disconnect message")
             return True
@@ -184,65 +201,32 @@ class TCPClient(ClientBase):
         
         try:
             # First receive message length
-            length_data = self.ssl_socket.recv(4)
-            if not length_data:
+            length_data = self._recv_exact(4)
+            if length_data is None:
                 self.logger.debug("Server closed connection")
                 self.is_connected = False
                 return None
             
-            message_len = int.from_bytes(length_data, byteorder='big')
-            
-            # Receive the actual message
-            received_data = b""
-            while len(received_data) < message_len:
-                chunk = self.ssl_socket.recv(min(self.buffer_size, message_len - len(received_data)))
-                if not chunk:
-                    break
-                received_data += chunk
-            
-            if received_data:
-                message_str = received_data.decode(self.encoding)
-                chat_message = ChatMessage.from_json(message_str)
-                return chat_message
+            message_len = FRAME_HEADER.unpack_from(length_data)[0]
             
-        except ssl.SSLError as e:
-            self.logger.error(f"SSL error receiving message: {e}")
-            self.is_connected = False
-        except socket.timeout:
-            self.logger.debug("Receive timeout")
-        except ConnectionResetError:
-            self.logger.error("Connection reset by server")
-            self.is_connected = False
-        except Exception as e:
-            self.logger.error(f"Error receiving message: {e}")
-            self.is_connected = False
-        
-        return None
-        """Receive encrypted message from server"""
-        if not self.is_connected or not self.ssl_socket:
-            return None
-        
-        try:
-            # First receive message length
-            length_data = self.ssl_socket.recv(4)
-            if not length_data:
-                self.logger.debug("Server closed connection")
+            # Checked before _recv_exact allocates the frame: a corrupt header must not
+            # make us reserve up to 4 GiB, and the stream is out of sync after it anyway
+            if message_len > self.max_message_size:
+                self.logger.error(f"Message too large ({message_len} bytes) — dropping connection")
                 self.is_connected = False
                 return None
             
-            message_len = int.from_bytes(length_data, byteorder='big')
-            
             # Receive the actual message
-            received_data = b""
-            while len(received_data) < message_len:
-                chunk = self.ssl_socket.recv(min(self.buffer_size, message_len - len(received_data)))
-                if not chunk:
-                    break
-                received_data += chunk
+            received_data = self._recv_exact(message_len)
+            if received_data is None:
+                self.logger.debug("Server closed connection mid-message")
+                self.is_connected = False
+                return None
+            # Once per complete frame, not per header/body read
+            self._enable_quickack(self.ssl_socket)
             
             if received_data:
-                message_str = received_data.decode(self.encoding)
-                chat_message = ChatMessage.from_json(message_str)
+                chat_message = ChatMessage.decode(received_data)
                 return chat_message
             
         except ssl.SSLError as e:
@@ -258,71 +242,93 @@ class TCPClient(ClientBase):
             self.is_connected = False
         
         return None
-        """Receive a single message from server"""
-        if not self.is_connected or not self.socket:
-            return None
-        
-        try:
-            # First receive message length
-            length_data = self.socket.recv(4)
-            if not length_data:
-                self.logger.debug("Server closed connection")
-                self.is_connected = False
+    
+    def _recv_exact(self, size: int) -> Optional[bytearray]:
+        """Read exactly size bytes into a preallocated buffer (None if the peer closed)"""
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = self.ssl_socket.recv_into(view[received:], min(self.buffer_size, size - received))
+            if not count:
                 return None
-            
-            message_len = int.from_bytes(length_data, byteorder='big')
-            
-            # Receive the actual message
-            received_data = b""
-            while len(received_data) < message_len:
-                chunk = self.socket.recv(min(self.buffer_size, message_len - len(received_data)))
-                if not chunk:
-                    break
-                received_data += chunk
-            
-            if received_data:
-                message_str = received_data.decode(self.encoding)
-                chat_message = ChatMessage.from_json(message_str)
-                return chat_message
-            
-        except socket.timeout:
-            self.logger.debug("Receive timeout")
-        except ConnectionResetError:
-            self.logger.error("Connection reset by server")
-            self.is_connected = False
-        except Exception as e:
-            self.logger.error(f"Error receiving message: {e}")
-            self.is_connected = False
-        
-        return None
+            received += count
+        return buffer
+    
+    def _enable_quickack(self, sock):
+        """Re-arm TCP_QUICKACK where supported (the kernel resets it after receives)"""
+        if TCP_QUICKACK is None:
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+        except OSError:
+            pass
     
     def start_listening(self, callback: Callable[[ChatMessage], None]):
         """Start background thread to listen for messages"""
         self.receive_callback = callback
         self.should_listen = True
+        
+        # Reuse a listener that is still running instead of racing a second one on the socket
+        if self.receive_thread and self.receive_thread.is_alive():
+            return
+        if self._wakeup_r is None:
+            self._wakeup_r, self._wakeup_w = socket.socketpair()
+            self._wakeup_r.setblocking(False)
+            self._wakeup_w.setblocking(False)
         self.receive_thread = threading.Thread(target=self._listen_loop, daemon=True)
         self.receive_thread.start()
     
     def _listen_loop(self):
-        """Background thread loop for receiving messages"""
-        while self.should_listen and self.is_connected:
-            try:
+        """Background thread loop for receiving messages
+        
+        Waits on the socket and the wakeup pipe, so stop_listening can interrupt
+        the wait without touching the connection.
+        """
+        selector = selectors.DefaultSelector()
+        try:
+            selector.register(self.ssl_socket, selectors.EVENT_READ)
+            selector.register(self._wakeup_r, selectors.EVENT_READ)
+            # receive_message handles socket errors itself, so the steady-state path
+            # raises nothing; only the callback is guarded
+            while self.should_listen and self.is_connected:
+                # TLS may already hold decrypted bytes the kernel no longer reports as readable
+                pending = getattr(self.ssl_socket, "pending", None)
+                if not (pending and pending()):
+                    ready = selector.select()
+                    if any(key.fileobj is self._wakeup_r for key, _ in ready):
+                        try:
+                            self._wakeup_r.recv(256)  # Drain; flags are re-read next pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                
                 message = self.receive_message()
-                if message and self.receive_callback:
-                    self.receive_callback(message)
-                elif not self.is_connected:
-                    break
-            except Exception as e:
+                if message is None:
+                    continue  # Loop condition notices a dropped connection
+                if self.receive_callback:
+                    try:
+                        self.receive_callback(message)
+                    except Exception as e:
+                        self.logger.error(f"Error in receive callback: {e}")
+        except (OSError, ValueError) as e:
+            # Socket closed underneath the selector
+            if self.is_connected:
                 self.logger.error(f"Error in listen loop: {e}")
-                break
-            time.sleep(0.1)
+        finally:
+            selector.close()
         
         self.logger.debug("Listen loop ended")
     
     def stop_listening(self):
-        """Stop the background listening thread"""
+        """Stop the background listening thread (the connection stays open)"""
         self.should_listen = False
         if self.receive_thread and self.receive_thread.is_alive():
+            # Wake the listener waiting in select()
+            try:
+                self._wakeup_w.send(b"\0")
+            except (OSError, AttributeError):
+                pass  # Pipe full (a wakeup is already pending)
             self.receive_thread.join(timeout=1.0)
     
     def disconnect(self):
@@ -333,11 +339,22 @@ class TCPClient(ClientBase):
         self.stop_listening()
         self.is_connected = False
         
+        if self._wakeup_r:
+            self._wakeup_r.close()
+            self._wakeup_w.close()
+            self._wakeup_r = self._wakeup_w = None
+        
         # Close SSL socket properly
         if self.ssl_socket:
             try:
-                # Send SSL shutdown
-                self.ssl_socket.unwrap()
+                if self.receive_thread and self.receive_thread.is_alive():
+                    # Listener still blocked in a read: unwrapping would drive the same
+                    # TLS session from two threads, so release it by shutting down instead
+                    self.ssl_socket.shutdown(socket.SHUT_RDWR)
+                else:
+                    # Send SSL shutdown; bounded, since unwrap waits for the server's close_notify
+                    self.ssl_socket.settimeout(1.0)
+                    self.ssl_socket.unwrap()
                 self.ssl_socket.close()
             except:
                 pass
@@ -362,63 +379,74 @@ class TCPClient(ClientBase):
             return
 
         print("\n📡 Running TCP Connection Test (10 packets - excluding first from results)...")
-        all_latencies = []  # Store all 10 measurements
+        import numpy as np
+        all_latencies = np.full(10, np.nan)  # NaN marks a lost or invalid packet
+
+        # Bound each receive so the test can't block forever on a lost reply
+        original_timeout = self.ssl_socket.gettimeout()
+        self.ssl_socket.settimeout(1.0)
+
+        # Built once; only the timestamp changes between packets
+        test_msg = ChatMessage(
+            type=MessageType.TEST,
+            content="",
+            timestamp=0.0,
+            username=self.username or "tester",
+            version="1.0"
+        )
 
         for i in range(10):
             send_time = time.time()
-
-            test_msg = ChatMessage(
-                type=MessageType.TEST,
-                content=f"",
-                timestamp=send_time,
-                username=self.username or "tester",
-                version="1.0"
-            )
+            test_msg.timestamp = send_time
 
             # Send
             try:
-                data = test_msg.to_json().encode(self.encoding)
-                self.ssl_socket.sendall(len(data).to_bytes(4, byteorder="big"))
-                self.ssl_socket.sendall(data)
+                data = test_msg.encode()
+                self._send_frame(data)
                 print(f"message sent from client : {data}")
             except Exception as e:
-                all_latencies.append(None)
                 print(f"[{i+1:2d}] ❌ send failed")
                 continue
 
-            # Wait up to 1 second for reply
-            start = time.time()
+            # Wait up to 1 second for reply; the deadline uses the monotonic clock,
+            # while send_time stays wall-clock because the server stamps its own time
+            deadline = time.perf_counter() + 1.0
             reply_msg = None
-            while time.time() - start < 1.0:
+            while self.is_connected:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                # Block in recv until data arrives or the deadline passes
+                self.ssl_socket.settimeout(remaining)
                 msg = self.receive_message()
                 #print(f"raw message from server is {msg}")
                 if msg and msg.type == MessageType.TEST and msg.username == "server":
                     reply_msg = msg
                     break
-                time.sleep(0.0001)
 
             if reply_msg:
                 try:
                     server_recv_time = float(reply_msg.timestamp)
                     print(f"server_recv_time : {server_recv_time}")
                     latency = (server_recv_time - send_time) * 1000
-                    all_latencies.append(latency)
+                    all_latencies[i] = latency
                     print(f"[{i+1}] ✅ {latency:.1f} ms")
                 except ValueError:
-                    all_latencies.append(None)
                     print(f"[{i+1}] ❌ invalid time")
             else:
-                all_latencies.append(None)
                 print(f"[{i+1:2d}] ❌ timeout")
 
             time.sleep(0.001)
 
+        self.ssl_socket.settimeout(original_timeout)
+
         # === CALCULATIONS - EXCLUDE FIRST PACKET ===
         # Use only packets 2-10 (slice from index 1 to end)
-        latencies = all_latencies[1:]  # This excludes the first measurement
+        latencies = all_latencies[1:]
+        valid = latencies[~np.isnan(latencies)]
         
-        total_packets = len(latencies)  # Should be 9
-        received = sum(1 for x in latencies if x is not None)
+        total_packets = latencies.size  # Should be 9
+        received = valid.size
         lost = total_packets - received
         loss_pct = (lost / total_packets) * 100
         
@@ -429,18 +457,21 @@ class TCPClient(ClientBase):
         print(f"   Packet Loss: {loss_pct:.1f}%")
 
         if received > 0:
-            valid = [x for x in latencies if x is not None]
-            avg = sum(valid) / len(valid)
-            min_latency = min(valid)
-            max_latency = max(valid)
+            avg = valid.mean()
+            min_latency = valid.min()
+            max_latency = valid.max()
+            p50, p95, p99 = np.percentile(valid, [50, 95, 99])
             print(f"   Latency - Avg: {avg:.2f} ms, Min: {min_latency:.2f} ms, Max: {max_latency:.2f} ms")
+            print(f"   Latency - p50: {p50:.2f} ms, p95: {p95:.2f} ms, p99: {p99:.2f} ms")
         else:
             print("   ❌ No successful measurements")
 
         # === PLOT - EXCLUDE FIRST PACKET ===
+        # Imported here so ordinary chat sessions never pay matplotlib's startup cost
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(8, 4))
         # Plot packets 2-10 (sequence numbers 2 through 10)
-        seqs = list(range(2, 11))  # This creates [2, 3, 4, ..., 10]
+        seqs = np.arange(2, 2 + total_packets)  # [2, 3, 4, ..., 10]
         plt.plot(seqs, latencies, 'o-', label="One-Way Latency (C→S)")
         plt.xlabel("Packet #")
         plt.ylabel("Latency (ms)")
@@ -453,7 +484,8 @@ class TCPClient(ClientBase):
                         f"Loss: {loss_pct:.1f}%\n"
                         f"Avg Latency: {avg:.2f} ms\n"
                         f"Min: {min_latency:.2f} ms\n"
-                        f"Max: {max_latency:.2f} ms")
+                        f"Max: {max_latency:.2f} ms\n"
+                        f"p95: {p95:.2f} ms")
         else:
             stats_text = f"Packets: 0/{total_packets}\nLoss: 100.0%"
             
@@ -461,8 +493,8 @@ class TCPClient(ClientBase):
         plt.show()
         
         # Optional: Show what the first packet result was
-        first_packet = all_latencies[0] if all_latencies else None
-        if first_packet is not None:
+        first_packet = all_latencies[0]
+        if not np.isnan(first_packet):
             print(f"\n📝 Note: First packet latency was {first_packet:.1f} ms (excluded from results)")
         else:
             print(f"\n📝 Note: First packet was lost (excluded from results)")
@@ -477,47 +509,45 @@ class TCPClient(ClientBase):
             self.socket.settimeout(0.01)
             
             # Keep reading until we have a complete message or timeout
+            buffer = self._recv_buffer
             while True:
-                # If we don't have the length header yet, read it
-                if len(self._recv_buffer) < 4:
-                    chunk = self.socket.recv(4 - len(self._recv_buffer))
-                    if not chunk:
-                        return None
-                    self._recv_buffer += chunk
-                    if len(self._recv_buffer) < 4:
-                        continue  # Still don't have full header
-
-                # We have the header - parse message length
-                length_bytes = self._recv_buffer[:4]
-                message_len = int.from_bytes(length_bytes, 'big')
+                head = self._recv_head
+                if len(buffer) - head >= 4:
+                    # We have the header - parse message length
+                    message_len = FRAME_HEADER.unpack_from(buffer, head)[0]
 
-                # Safety check
-                if message_len > 1024 * 1024:  # 1 MB max
-                    self.logger.error("Message too large — clearing buffer")
-                    self._recv_buffer = b""
-                    return None
-
-                # Read the rest of the message if we don't have it
-                total_needed = 4 + message_len
-                if len(self._recv_buffer) < total_needed:
-                    chunk = self.socket.recv(total_needed - len(self._recv_buffer))
-                    if not chunk:
+                    # Safety check
+                    if message_len > self.max_message_size:
+                        self.logger.error("Message too large — clearing buffer")
+                        buffer.clear()
+                        self._recv_head = 0
                         return None
-                    self._recv_buffer += chunk
-                    if len(self._recv_buffer) < total_needed:
-                        continue  # Still don't have full message
 
-                # We have a complete message - extract and process it
-                json_data = self._recv_buffer[4:total_needed]
-                self._recv_buffer = self._recv_buffer[total_needed:]  # Keep rest
+                    end = head + 4 + message_len
+                    if len(buffer) >= end:
+                        # We have a complete message - extract it and advance the head
+                        json_data = bytes(buffer[head + 4:end])
+                        if end == len(buffer):
+                            buffer.clear()
+                            self._recv_head = 0
+                        elif end > len(buffer) // 2:
+                            del buffer[:end]
+                            self._recv_head = 0
+                        else:
+                            self._recv_head = end
 
-                try:
-                    message_str = json_data.decode(self.encoding)
-                    chat_message = ChatMessage.from_json(message_str)
-                    return chat_message
-                except Exception as e:
-                    self.logger.error(f"Failed to decode message: {e}")
-                    continue
+                        try:
+                            chat_message = ChatMessage.decode(json_data)
+                            return chat_message
+                        except Exception as e:
+                            self.logger.error(f"Failed to decode message: {e}")
+                            continue
+
+                # Need more data - read whatever is available, not just one frame
+                count = self.socket.recv_into(self._recv_chunk)
+                if not count:
+                    return None
+                buffer += memoryview(self._recv_chunk)[:count]
 
         except socket.timeout:
             # Expected - no data available right now
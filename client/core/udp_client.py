@@ -1,79 +1,190 @@
+import heapq
 import socket
+import selectors
+import struct
+import sys
 import threading
 import time
+import itertools
 import json
-from typing import Callable, Optional
-from .client_base import ClientBase
+import logging
+import random
+import re
+from typing import Callable, List, Optional
+from .batch_send import SENDMMSG_AVAILABLE, send_batch
+from .client_base import ClientBase, SOCKET_BUFFER_SIZE
 from .message_protocol import ChatMessage, MessageType
-import matplotlib.pyplot as plt 
+
+# Linux busy-poll socket option (not exported by the socket module)
+SO_BUSY_POLL = getattr(socket, "SO_BUSY_POLL", 46 if sys.platform.startswith("linux") else None)
+
+# Linux kernel receive timestamps, delivered as a struct timespec control message
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None)
+_TIMESPEC = struct.Struct("@ll")
+# Every server TEST reply carries this username; datagrams without it are skipped undecoded
+_SERVER_NAME = b"server"
+
+# Server ACKs start with this prefix; their sequence number is read straight from the raw
+# datagram (the ACK body is JSON embedded as a string, hence the optional backslashes)
+_ACK_PREFIX = b'{"type":"ack"'
+_ACK_SEQUENCE = re.compile(rb'\\?"sequence\\?"\s*:\s*(-?\d+)')
+# Optional receive window in the same ACK: highest sequence seen plus a bitfield of earlier ones
+_ACK_WINDOW = re.compile(rb'\\?"ack\\?"\s*:\s*(-?\d+)\s*,\s*\\?"ack_bits\\?"\s*:\s*(\d+)')
 
 class UDPClient(ClientBase):
     """UDP client implementation"""
     
-    def __init__(self, host, port, buffer_size=4096, encoding="utf-8", timeout=10):
-        super().__init__(host, port, buffer_size, encoding, timeout)
+    def __init__(self, host, port, buffer_size=65536, encoding="utf-8", timeout=10,
+                 socket_buffer_size=SOCKET_BUFFER_SIZE, busy_poll_us=0):
+        super().__init__(host, port, buffer_size, encoding, timeout, socket_buffer_size)
+        self.busy_poll_us = busy_poll_us  # 0 disables kernel busy polling
         self.socket = None
         self.receive_callback = None
-        self.receive_thread = None
+        self.receive_thread = None  # Single I/O thread: delivers messages and fires retransmissions
         self.should_listen = False
         self.server_address = (host, port)
         self.username = None
-        self.sequence_number = 0  # For message ordering
+        self._sequence = itertools.count()  # For message ordering; next() is atomic under the GIL
         self.pending_acknowledgements = {}  # For reliable UDP
         self.connection_verified = False  # Track if server is reachable
         self.max_retries = None  # None means infinite retries
         self.retransmit_timeout = 2.0  # Time before retransmission
+        self.max_retransmit_timeout = 30.0  # Cap for the exponential backoff between retries
+        self._rx_timestamps = False  # Set by connect() when SO_TIMESTAMPNS is enabled
+        self.verify_timeout = 1.0  # How long connect() waits for the server to answer
+        self._rx_buf = bytearray(buffer_size)  # Reused by receive_message for every datagram
+        self._selector = None  # Readiness waits for the non-blocking socket (set by connect)
         self.recovery_mode = False # If true, client is recovering from disconnect
         self.should_retransmit = False
-        self.retransmit_thread = None
+        self._retransmit_heap = []  # (monotonic deadline, seq); entries of ACKed messages are skipped
+        self._retransmit_lock = threading.Lock()
+        self._io_lock = threading.Lock()  # Serializes starting and retiring the I/O thread
+        self._wakeup_r = self._wakeup_w = None  # Self-pipe that interrupts the I/O thread's select
     
     def connect(self) -> bool:
         """Setup UDP socket and verify server is reachable"""
         try:
+            # Resolve the host once; the probe's sendto and connect() then take a numeric address
+            self.server_address = (socket.gethostbyname(self.host), self.port)
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.socket.settimeout(1.5)  # Longer timeout for connection verification
+            # Bigger receive buffer so bursts aren't dropped while the listener catches up
+            self._set_socket_buffers(self.socket)
+            self._enable_busy_poll()
+            self._rx_timestamps = self._enable_rx_timestamps()
+            # Pin the local port up front instead of on the first sendto
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(("", 0))
+            # Non-blocking for good: every wait goes through the selector with its own
+            # timeout instead of re-arming the socket timeout per call site
+            self.socket.setblocking(False)
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.socket, selectors.EVENT_READ)
+            self._wakeup_r, self._wakeup_w = socket.socketpair()
+            self._wakeup_r.setblocking(False)
+            self._wakeup_w.setblocking(False)
             self.is_connected = True
             
             # Try to verify server is reachable by sending a test packet
             if self._verify_server_connection():
-                self.socket.settimeout(1.0)  # Reset to normal timeout
+                # Connected UDP: the kernel keeps the route and peer, so sends skip the
+                # per-call address lookup and datagrams from other hosts are dropped
+                self.socket.connect(self.server_address)
                 self.connection_verified = True
                 self.logger.info(f"UDP client connected to {self.host}:{self.port}")
                 return True
             else:
                 self.logger.error(f"UDP server not reachable at {self.host}:{self.port}")
                 self.is_connected = False
+                self._close_resources()
                 return False
                 
         except Exception as e:
             self.logger.error(f"Failed to setup UDP client: {e}")
             self.is_connected = False
+            self._close_resources()
+            return False
+    
+    def _close_resources(self):
+        """Close the selector, wakeup pipe and socket made by connect() (safe to call more than once)"""
+        if self._wakeup_r:
+            self._wakeup_r.close()
+            self._wakeup_w.close()
+            self._wakeup_r = self._wakeup_w = None
+        if self._selector:
+            try:
+                self._selector.unregister(self.socket)
+            except (KeyError, ValueError):
+                pass
+            self._selector.close()
+            self._selector = None
+        if self.socket:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+            finally:
+                self.socket = None
+    
+    def _enable_busy_poll(self):
+        """Let the kernel spin on the device queue briefly before sleeping in recv"""
+        if not self.busy_poll_us or SO_BUSY_POLL is None:
+            return
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, self.busy_poll_us)
+        except OSError as e:
+            # Raising the value above the sysctl default needs CAP_NET_ADMIN
+            self.logger.debug(f"Could not enable busy polling: {e}")
+    
+    def _enable_rx_timestamps(self) -> bool:
+        """Ask the kernel to timestamp incoming datagrams (used by the latency test)"""
+        if SO_TIMESTAMPNS is None or not hasattr(self.socket, "recvmsg_into"):
+            return False
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            return True
+        except OSError as e:
+            self.logger.debug(f"Kernel receive timestamps unavailable: {e}")
             return False
     
+    def _wait_readable(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for a datagram to be queued on the socket"""
+        return bool(self._selector.select(timeout))
+    
+    def _recv_timestamped(self, buffer: bytearray, clock_offset_ns: int):
+        """Receive one datagram into buffer - returns (size, arrival time in perf_counter_ns)
+        
+        Uses the kernel's arrival timestamp when available so scheduling delay before
+        this thread runs is not counted as network latency.
+        """
+        if not self._rx_timestamps:
+            return self.socket.recv_into(buffer), time.perf_counter_ns()
+        
+        count, ancdata, _, _ = self.socket.recvmsg_into([buffer], socket.CMSG_SPACE(_TIMESPEC.size))
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= _TIMESPEC.size:
+                seconds, nanoseconds = _TIMESPEC.unpack_from(data)
+                # Kernel stamps are wall-clock; shift them onto the perf_counter_ns timeline
+                return count, seconds * 1_000_000_000 + nanoseconds - clock_offset_ns
+        return count, time.perf_counter_ns()
+    
     def _verify_server_connection(self) -> bool:
         """Verify that the server is reachable by sending a test message"""
         try:
             # Create a test connection message
-            test_message = ChatMessage.create_connect_message("test_connection")
-            message_data = test_message.to_json().encode(self.encoding)
+            message_data = ChatMessage.encoded_control_message(MessageType.CONNECT, "test_connection")
             
             # Send test message
             self.socket.sendto(message_data, self.server_address)
             self.logger.debug(f"Sent connection test to {self.server_address}")
             
-            # Wait for any response (even if it's not the expected one)
-            start_time = time.time()
-            while time.time() - start_time < 3.0:  # 3 second timeout
-                try:
-                    data, addr = self.socket.recvfrom(self.buffer_size)
-                    if data:
-                        # If we get any response, server is reachable
-                        self.logger.debug(f"Server response received from {addr}")
-                        return True
-                except socket.timeout:
-                    continue
-                except BlockingIOError:
-                    continue
+            # Wait for any response (even if it's not the expected one) - the selector
+            # returns as soon as a datagram arrives or the deadline passes
+            if self._wait_readable(self.verify_timeout):
+                count, addr = self.socket.recvfrom_into(self._rx_buf)
+                if count:
+                    # If we get any response, server is reachable
+                    self.logger.debug(f"Server response received from {addr}")
+                    return True
             
             # No response received within timeout
             self.logger.warning("No response from server during connection test")
@@ -90,86 +201,179 @@ class UDPClient(ClientBase):
             return False
         
         try:
-            # Assign sequence number
-            sequence = self.sequence_number
-            self.sequence_number += 1
-            
-            # Create reliable message with sequence
-            chat_message = ChatMessage.create_reliable_message(
-                sequence=sequence,
-                content=message,
-                username=username or self.username
-            )
-            message_data = chat_message.to_json().encode(self.encoding)
+            sequence, message_data = self._encode_reliable(message, username)
+            # Tracked before it goes out: the I/O thread may read the ACK before send() returns
+            self._track_pending(sequence, message_data, message)
             
             # Send message
-            bytes_sent = self.socket.sendto(message_data, self.server_address)
-            
-            # Track for acknowledgement
-            self.pending_acknowledgements[sequence] = {
-                "message": message_data,
-                "sent_time": time.time(),
-                "retries": 0,
-                "content": message
-            }
-            
-            self.logger.debug(f"Reliable UDP message sent (seq={sequence}): {message}")
+            try:
+                self.socket.send(message_data)
+            except (BlockingIOError, ConnectionRefusedError) as e:
+                # Transient (full send buffer, or an ICMP port-unreachable queued by an
+                # earlier datagram): the message stays tracked for retransmission
+                self.logger.debug("Send of seq=%d deferred to retransmission: %s", sequence, e)
+            except Exception:
+                self._untrack_pending(sequence)
+                raise
             
-            # Start retransmission thread if not running
-            if not self.should_retransmit:
-                self.should_retransmit = True
-                self.retransmit_thread = threading.Thread(target=self._retransmit_loop, daemon=True)
-                self.retransmit_thread.start()
-                
+            self.logger.debug("Reliable UDP message sent (seq=%d): %s", sequence, message)
+            self._ensure_retransmitting()
             return True
         except Exception as e:
             self.logger.error(f"Failed to send UDP message: {e}")
             return False
     
-    def _retransmit_loop(self):
-        """Retransmit unacknowledged messages - INFINITE RETRIES"""
-        while self.should_retransmit and self.is_connected:
-            current_time = time.time()
-            sequences_to_retransmit = []
-            
-            # Check for messages needing retransmission
-            for seq, data in list(self.pending_acknowledgements.items()):
-                elapsed = current_time - data["sent_time"]
+    def send_messages(self, messages: list, username: str = None) -> int:
+        """Send a burst of messages reliably - returns how many were queued for delivery
+        
+        Every datagram is encoded and tracked before the first one goes out, then
+        the whole burst is handed to _send_batch (one sendmmsg call where available).
+        Datagrams the kernel did not take stay tracked and go out on retransmission.
+        """
+        if not self.is_connected or not self.socket or not self.connection_verified:
+            self.logger.error("UDP client not properly connected")
+            return 0
+        
+        batch = [self._encode_reliable(message, username) for message in messages]
+        for (sequence, message_data), message in zip(batch, messages):
+            self._track_pending(sequence, message_data, message)
+        
+        try:
+            sent = self._send_batch([message_data for _, message_data in batch])
+        except OSError as e:
+            self.logger.error(f"Failed to send UDP message batch: {e}")
+            for sequence, _ in batch:
+                self._untrack_pending(sequence)
+            return 0
+        
+        self.logger.debug("Reliable UDP batch sent: %d of %d messages", sent, len(batch))
+        if batch:
+            self._ensure_retransmitting()
+        return len(batch)
+    
+    def _encode_reliable(self, message: str, username: str = None):
+        """Assign the next sequence number and encode a reliable message"""
+        sequence = next(self._sequence)
+        
+        # Create reliable message with sequence
+        chat_message = ChatMessage.create_reliable_message(
+            sequence=sequence,
+            content=message,
+            username=username or self.username
+        )
+        return sequence, chat_message.encode()
+    
+    def _track_pending(self, sequence: int, message_data: bytes, content: str):
+        """Track a sent message until the server acknowledges it"""
+        self.pending_acknowledgements[sequence] = {
+            "message": message_data,
+            "retries": 0,
+            "content": content
+        }
+        with self._retransmit_lock:
+            heap = self._retransmit_heap
+            heapq.heappush(heap, (time.monotonic() + self.retransmit_timeout, sequence))
+            earliest = heap[0][1] == sequence
+        if earliest:
+            self._wake()  # The I/O thread may be sleeping with no deadline at all
+    
+    def _untrack_pending(self, sequence: int):
+        """Forget a tracked message whose send failed for good (its heap entry is skipped)"""
+        self.pending_acknowledgements.pop(sequence, None)
+    
+    def _ensure_retransmitting(self):
+        """Make sure the I/O thread is running to fire retransmissions"""
+        self.should_retransmit = True
+        self._ensure_io_thread()
+    
+    def _retransmit_due(self) -> Optional[float]:
+        """Retransmit unacknowledged messages whose deadline passed - INFINITE RETRIES
+        
+        Returns the seconds until the next deadline (None if nothing is pending).
+        Each retry doubles the wait up to max_retransmit_timeout, with +/-20% jitter
+        so messages lost together don't keep retrying in lockstep.
+        """
+        now = time.monotonic()
+        payloads = []
+        log_retries = self.logger.isEnabledFor(logging.INFO)
+        
+        # Pop every deadline that has passed; anything not yet due stays in the heap
+        with self._retransmit_lock:
+            heap = self._retransmit_heap
+            while heap and heap[0][0] <= now:
+                _, seq = heapq.heappop(heap)
+                # The ACK may have arrived since it was scheduled - look it up once
+                data = self.pending_acknowledgements.get(seq)
+                if data is None:
+                    continue
                 
-                if elapsed > self.retransmit_timeout:
-                    sequences_to_retransmit.append(seq)
-                    data["retries"] += 1
-                    data["sent_time"] = current_time
-                    
-                    # Log first few retries, then less frequently
-                    if data["retries"] <= 3 or data["retries"] % 10 == 0:
-                        self.logger.info(f"Retransmitting seq={seq} (attempt {data['retries']})")
-                    
-                    # Enter recovery mode if we're retrying
-                    if not self.recovery_mode:
-                        self.recovery_mode = True
-                        self.logger.warning("Entering recovery mode - connection issues detected")
-            
-            # Retransmit messages
-            for seq in sequences_to_retransmit:
-                if seq in self.pending_acknowledgements:
-                    try:
-                        message_data = self.pending_acknowledgements[seq]["message"]
-                        self.socket.sendto(message_data, self.server_address)
-                        
-                        # If successful, we might be reconnected
-                        if self.recovery_mode and len(sequences_to_retransmit) > 0:
-                            self.logger.info(f"Recovery attempt for seq={seq}")
-                            
-                    except Exception as e:
-                        self.logger.error(f"Failed to retransmit seq={seq}: {e}")
-            
-            # Exit recovery mode if all ACKs received
-            if self.recovery_mode and not self.pending_acknowledgements:
-                self.recovery_mode = False
-                self.logger.info("Recovery complete - all messages acknowledged")
+                data["retries"] += 1
+                backoff = min(self.max_retransmit_timeout,
+                              self.retransmit_timeout * 2 ** min(data["retries"], 6))
+                backoff *= random.uniform(0.8, 1.2)
+                heapq.heappush(heap, (now + backoff, seq))
+                payloads.append(data["message"])
+                
+                # Log first few retries, then less frequently
+                if log_retries and (data["retries"] <= 3 or data["retries"] % 10 == 0):
+                    self.logger.info("Retransmitting seq=%d (attempt %d)", seq, data["retries"])
+            next_deadline = heap[0][0] if heap else None
+        
+        if payloads:
+            # Enter recovery mode if we're retrying
+            if not self.recovery_mode:
+                self.recovery_mode = True
+                self.logger.warning("Entering recovery mode - connection issues detected")
             
-            time.sleep(0.5)  # Increased sleep to reduce CPU usage during retries
+            try:
+                sent = self._send_batch(payloads)
+            except OSError as e:
+                self.logger.error(f"Failed to retransmit: {e}")
+                sent = 0
+            # If successful, we might be reconnected
+            if sent:
+                self.logger.info("Recovery attempt for %d messages", sent)
+        
+        # Exit recovery mode if all ACKs received
+        if self.recovery_mode and not self.pending_acknowledgements:
+            self.recovery_mode = False
+            self.logger.info("Recovery complete - all messages acknowledged")
+        
+        return None if next_deadline is None else max(0.0, next_deadline - time.monotonic())
+    
+    def _send_batch(self, payloads: list) -> int:
+        """Send datagrams to the server - returns how many the kernel accepted
+        
+        Uses one sendmmsg call per batch_send.MAX_BATCH_SIZE datagrams where available and
+        falls back to a send per datagram otherwise. The socket is connected, so
+        the messages carry no destination address. A full send buffer or a queued
+        ICMP port-unreachable (server down for now) ends the batch early; other
+        errors raise OSError unless some datagrams already went out.
+        """
+        if SENDMMSG_AVAILABLE:
+            try:
+                # A short count means the send buffer filled; the rest go out on retransmission
+                return send_batch(self.socket.fileno(), payloads)
+            except ConnectionRefusedError as e:
+                self.logger.debug("Server unreachable, batch left for retransmission: %s", e)
+                return 0
+        
+        sent = 0
+        send = self.socket.send
+        for payload in payloads:
+            try:
+                send(payload)
+            except BlockingIOError:
+                break
+            except ConnectionRefusedError as e:
+                self.logger.debug("Server unreachable, batch left for retransmission: %s", e)
+                break
+            except OSError:
+                if sent:
+                    break
+                raise
+            sent += 1
+        return sent
     
     def send_connect_message(self, username: str) -> bool:
         """Send connection message to server via UDP"""
@@ -178,10 +382,9 @@ class UDPClient(ClientBase):
         
         try:
             self.username = username
-            chat_message = ChatMessage.create_connect_message(username)
-            message_data = chat_message.to_json().encode(self.encoding)
+            message_data = ChatMessage.encoded_control_message(MessageType.CONNECT, username)
             
-            self.socket.sendto(message_data, self.server_address)
+            self.socket.send(message_data)
             self.logger.info(f"Sent UDP connect message for user: {username}")
             return True
         except Exception as e:
@@ -194,56 +397,109 @@ class UDPClient(ClientBase):
             return False
         
         try:
-            chat_message = ChatMessage.create_disconnect_message(self.username)
-            message_data = chat_message.to_json().encode(self.encoding)
+            message_data = ChatMessage.encoded_control_message(MessageType.DISCONNECT, self.username)
             
-            self.socket.sendto(message_data, self.server_address)
+            self.socket.send(message_data)
             self.logger.info("Sent UDP disconnect message")
             return True
+        except ConnectionRefusedError as e:
+            self.logger.debug("Server unreachable, UDP disconnect message not sent: %s", e)
+            return False
         except Exception as e:
             self.logger.error(f"Failed to send UDP disconnect message: {e}")
             return False
     
-    def receive_message(self) -> Optional[ChatMessage]:
-        """Receive a single message from server via UDP"""
+    def receive_message(self, timeout: float = 1.0) -> Optional[ChatMessage]:
+        """Receive a single message from server via UDP (waits up to timeout seconds)"""
         if not self.is_connected or not self.socket or not self.connection_verified:
             return None
         
         try:
-            data, addr = self.socket.recvfrom(self.buffer_size)
-            if data:
-                message_str = data.decode(self.encoding)
-                chat_message = ChatMessage.from_json(message_str)
-                
-                # Handle ACK messages
-                if chat_message.type == MessageType.ACK:
-                    self._handle_ack_message(chat_message)
-                    return None  # Don't pass ACKs to chat
-                
-                return chat_message
-        except socket.timeout:
-            pass
+            if not self._wait_readable(timeout):
+                return None
         except Exception as e:
             self.logger.error(f"Error receiving UDP message: {e}")
+            return None
         
-        return None
+        messages = self.receive_batch(1)
+        return messages[0] if messages else None
+    
+    def receive_batch(self, max_batch: int = 32) -> List[ChatMessage]:
+        """Receive every datagram already queued on the socket (up to max_batch)
+        
+        Never waits: reads stop at the first EAGAIN, so a burst is drained in
+        one wakeup.
+        """
+        messages = []
+        # Hot loop: resolve attributes once so each datagram costs only local lookups
+        recv_into = self.socket.recv_into
+        buffer = self._rx_buf  # Long-lived buffer; the sender address is never used
+        decode = ChatMessage.decode
+        append = messages.append
+        ack = MessageType.ACK
+        ack_sequence = _ACK_SEQUENCE.search
+        ack_window = _ACK_WINDOW.search
+        for _ in range(max_batch):
+            try:
+                count = recv_into(buffer)
+                if not count:
+                    continue
+                if buffer.startswith(_ACK_PREFIX, 0, count):
+                    # Fast path: no ChatMessage or JSON parse just to read one integer
+                    match = ack_sequence(buffer, 0, count)
+                    if match is not None:
+                        self._acknowledge(int(match.group(1)))
+                        window = ack_window(buffer, match.end(), count)
+                        if window is not None:
+                            self._acknowledge_window(int(window.group(1)), int(window.group(2)))
+                        continue
+                chat_message = decode(buffer[:count])
+            except BlockingIOError:
+                break  # Queue drained
+            except ConnectionRefusedError as e:
+                # ICMP port-unreachable for an earlier datagram - reported once, then cleared
+                self.logger.debug("Server unreachable: %s", e)
+                continue
+            except Exception as e:
+                self.logger.error(f"Error receiving UDP message: {e}")
+                break
+            
+            # Handle ACK messages
+            if chat_message.type is ack:
+                self._handle_ack_message(chat_message)
+                continue  # Don't pass ACKs to chat
+            append(chat_message)
+        return messages
     
     def _handle_ack_message(self, chat_message: ChatMessage):
-        """Handle acknowledgement from server"""
+        """Handle acknowledgement from server (slow path for ACKs the byte scan missed)"""
         try:
             ack_data = json.loads(chat_message.content)
-            sequence = ack_data.get("sequence")
-            
-            if sequence is not None and sequence in self.pending_acknowledgements:
-                content = self.pending_acknowledgements[sequence]["content"]
-                del self.pending_acknowledgements[sequence]
-                self.logger.debug(f"ACK for seq={sequence}: {content}")
-                
-                if not self.pending_acknowledgements:
-                    self.should_retransmit = False
+            self._acknowledge(ack_data.get("sequence"))
+            if ack_data.get("ack") is not None:
+                self._acknowledge_window(ack_data["ack"], ack_data.get("ack_bits", 0))
         except json.JSONDecodeError:
             self.logger.error("Invalid ACK format")
     
+    def _acknowledge(self, sequence: int):
+        """Stop retransmitting an acknowledged sequence"""
+        # Single pop so a concurrent scan or duplicate ACK can't race a check-then-delete
+        pending = self.pending_acknowledgements.pop(sequence, None)
+        if pending is not None:
+            self.logger.debug("ACK for seq=%s: %s", sequence, pending["content"])
+    
+    def _acknowledge_window(self, ack: int, ack_bits: int):
+        """Clear every sequence the server's receive window reports, recovering lost ACKs"""
+        if not self.pending_acknowledgements:
+            return
+        self._acknowledge(ack)
+        sequence = ack - 1
+        while ack_bits:
+            if ack_bits & 1:
+                self._acknowledge(sequence)
+            ack_bits >>= 1
+            sequence -= 1
+    
     def start_listening(self, callback: Callable[[ChatMessage], None]):
         """Start background thread to listen for UDP messages"""
         if not self.connection_verified:
@@ -252,27 +508,82 @@ class UDPClient(ClientBase):
             
         self.receive_callback = callback
         self.should_listen = True
-        self.receive_thread = threading.Thread(target=self._listen_loop, daemon=True)
-        self.receive_thread.start()
+        self._ensure_io_thread()
     
-    def _listen_loop(self):
-        """Background thread loop for receiving UDP messages"""
-        while self.should_listen and self.is_connected and self.connection_verified:
-            try:
-                message = self.receive_message()
-                if message and self.receive_callback:
-                    self.receive_callback(message)
-            except Exception as e:
+    def _ensure_io_thread(self):
+        """Start the I/O thread, or wake the running one so it picks up new work"""
+        with self._io_lock:
+            if self.receive_thread is not None:
+                self._wake()
+                return
+            self.receive_thread = threading.Thread(target=self._io_loop, daemon=True)
+            self.receive_thread.start()
+    
+    def _wake(self):
+        """Interrupt the I/O thread's select so it re-reads flags and deadlines"""
+        try:
+            self._wakeup_w.send(b"\0")
+        except (OSError, AttributeError):
+            pass  # Pipe full (a wakeup is already pending) or client disconnected
+    
+    def _io_loop(self):
+        """Background thread loop: receive UDP messages and fire due retransmissions
+        
+        One selector waits on the socket and the wakeup pipe, with a timeout of
+        "time until the next retransmission deadline".
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_r, selectors.EVENT_READ)
+        listening = False
+        try:
+            while True:
+                with self._io_lock:
+                    if not (self.is_connected and self.connection_verified
+                            and (self.should_listen or self.should_retransmit)):
+                        self.receive_thread = None
+                        return
+                
+                # Only watch the socket while someone wants the messages
+                if self.should_listen != listening:
+                    listening = self.should_listen
+                    if listening:
+                        selector.register(self.socket, selectors.EVENT_READ)
+                    else:
+                        selector.unregister(self.socket)
+                
+                timeout = self._retransmit_due() if self.should_retransmit else None
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is self._wakeup_r:
+                        try:
+                            self._wakeup_r.recv(256)  # Drain; flags are re-read next pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    try:
+                        callback = self.receive_callback
+                        for message in self.receive_batch():
+                            if callback:
+                                callback(message)
+                    except Exception as e:
+                        self.logger.error(f"Error in UDP listen loop: {e}")
+        except (OSError, ValueError) as e:
+            # Socket closed underneath the selector during disconnect
+            if self.is_connected:
                 self.logger.error(f"Error in UDP listen loop: {e}")
-                if not self.is_connected:
-                    break
-            time.sleep(0.05)  # Shorter delay for UDP
+        finally:
+            selector.close()
+            with self._io_lock:
+                if self.receive_thread is threading.current_thread():
+                    self.receive_thread = None
     
     def stop_listening(self):
-        """Stop the background listening thread"""
+        """Stop delivering UDP messages (the I/O thread exits unless retransmissions are pending)"""
         self.should_listen = False
-        if self.receive_thread and self.receive_thread.is_alive():
-            self.receive_thread.join(timeout=1.0)
+        thread = self.receive_thread
+        if thread is not None:
+            self._wake()
+            if not self.should_retransmit:
+                thread.join(timeout=1.0)
     
     def disconnect(self):
         """Disconnect UDP client - clear all pending messages"""
@@ -283,107 +594,119 @@ class UDPClient(ClientBase):
         if pending_count > 0:
             self.logger.warning(f"Clearing {pending_count} pending messages on disconnect")
             self.pending_acknowledgements.clear()
+        with self._retransmit_lock:
+            self._retransmit_heap.clear()
 
-            if self.retransmit_thread and self.retransmit_thread.is_alive():
-                self.retransmit_thread.join(timeout=2.0)
         if self.is_connected and self.connection_verified:
             self.send_disconnect_message()
         
         self.stop_listening()
         self.is_connected = False
         self.connection_verified = False
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
-            finally:
-                self.socket = None
+        self._close_resources()
         self.logger.info("UDP client disconnected")
 
 
     def connection_test_calculation(self):
-        """Run connection test: send 10 UDP test packets, measure latency & loss (excluding 1st)."""
+        """Run connection test: send 10 UDP test packets, measure round-trip time & loss (excluding 1st)."""
         if not self.is_connected or not self.socket or not self.connection_verified:
             print("❌ Not connected — aborting test.")
             return
 
         print("\n📡 Running UDP Connection Test (10 packets - excluding first from results)...")
-        all_latencies = []
+        import numpy as np
 
-        # Set socket timeout for the entire test
-        original_timeout = self.socket.gettimeout()
-        self.socket.settimeout(1.0)
+        # Own receive buffer - the listener thread may be using _rx_buf concurrently
+        test_buf = bytearray(self.buffer_size)
+        # Maps kernel (wall-clock) receive timestamps onto the perf_counter_ns send stamps
+        clock_offset_ns = time.time_ns() - time.perf_counter_ns()
         
-        try:
-            for i in range(10):
-                send_time = time.time()
-
-                # Create test message with proper content
-                test_msg = ChatMessage(
-                    type=MessageType.TEST,
-                    content=f"test_packet_{i+1}",
-                    timestamp=send_time,
-                    username=self.username or "tester"
-                )
-
-                # Send via UDP
-                try:
-                    data = test_msg.to_json().encode(self.encoding)
-                    self.socket.sendto(data, self.server_address)
-                    print(f"[{i+1:2d}] SEND: {len(data)} bytes @ {send_time:.6f}")
-                except Exception as e:
-                    print(f"[{i+1:2d}] ❌ send failed: {e}")
-                    all_latencies.append(None)
-                    continue
+        # Built once; only content and timestamp change between packets
+        test_msg = ChatMessage(
+            type=MessageType.TEST,
+            content="",
+            timestamp=0,
+            username=self.username or "tester"
+        )
+        
+        all_latencies = np.full(10, np.nan)  # NaN marks a packet with no reply
+        # Echoed content -> (packet index, send time), so replies can arrive in any order.
+        # Matched on content: the decoder may hand the echoed timestamp back as a float,
+        # which no longer equals the integer send time once it passes 2**53 ns. The run id
+        # keeps a late echo from an earlier test from pairing with this run's probe
+        run_id = time.monotonic_ns()
+        sent = {}
+        
+        # Fire every probe back-to-back instead of paying one round trip per packet
+        for i in range(10):
+            # The server echoes this value back unchanged, so integer monotonic
+            # nanoseconds give a round-trip time NTP adjustments can't skew
+            send_time = time.perf_counter_ns()
+            content = f"test_{run_id}_{i+1}"
+            test_msg.content = content
+            test_msg.timestamp = send_time
 
-                # Wait for reply - handle multiple message types until we get TEST reply
-                reply_received = False
-                start_time = time.time()
-                
-                while time.time() - start_time < 1.0 and not reply_received:
-                    try:
-                        raw_data, addr = self.socket.recvfrom(self.buffer_size)
-                        recv_time = time.time()
-                        msg_str = raw_data.decode(self.encoding)
-                        msg = ChatMessage.from_json(msg_str)
+            # Send via UDP
+            try:
+                data = test_msg.encode()
+                self.socket.send(data)
+                sent[content] = (i, send_time)
+                print(f"[{i+1:2d}] SEND: {len(data)} bytes @ {send_time} ns")
+            except Exception as e:
+                print(f"[{i+1:2d}] ❌ send failed: {e}")
 
-                        # DEBUG: Print what we received
-                        print(f"[{i+1:2d}] 🔍 DEBUG: Received {msg.type} from {msg.username}")
+        # Collect replies - handle multiple message types until every TEST reply is in
+        deadline = time.perf_counter() + 1.0
+        pending = len(sent)
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                if not self._wait_readable(remaining):
+                    break  # No more data available
+                count, recv_time = self._recv_timestamped(test_buf, clock_offset_ns)
+                datagram = test_buf[:count]
+                if _SERVER_NAME not in datagram:
+                    continue  # Broadcast from another user - can't be a TEST reply
+                msg = ChatMessage.decode(datagram)
 
-                        # Only accept TEST replies from server
-                        if msg.type == MessageType.TEST and msg.username == "server":
-                            # Calculate one-way latency (server echoes original timestamp)
-                            server_timestamp = msg.timestamp
-                            latency = (recv_time - server_timestamp) * 1000.0
-                            all_latencies.append(latency)
-                            print(f"[{i+1:2d}] ✅ {latency:.2f} ms")
-                            reply_received = True
-                        else:
-                            # Ignore other message types (like CONNECT replies) and continue waiting
-                            print(f"[{i+1:2d}] 🔄 Ignoring {msg.type} message, waiting for TEST reply...")
-                            continue
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("Received %s from %s", msg.type.name, msg.username)
 
-                    except socket.timeout:
-                        break  # No more data available
-                    except Exception as e:
-                        print(f"[{i+1:2d}] ❌ receive error: {e}")
-                        break
+                # Only accept TEST replies from server that match a probe of this run
+                probe = None
+                if msg.type == MessageType.TEST and msg.username == "server":
+                    probe = sent.pop(msg.content, None)
+                if probe is None:
+                    # Ignore other message types (like CONNECT replies) and continue waiting
+                    self.logger.debug("Ignoring %s message, waiting for TEST reply", msg.type.name)
+                    continue
 
-                if not reply_received:
-                    all_latencies.append(None)
-                    print(f"[{i+1:2d}] ❌ timeout - no TEST reply received")
+                # Round trip, from the exact integer send time kept for this probe
+                i, send_time = probe
+                if recv_time < send_time:
+                    # Arrived before this probe went out - cannot be its reply
+                    sent[msg.content] = probe
+                    continue
+                latency = (recv_time - send_time) / 1e6
+                all_latencies[i] = latency
+                pending -= 1
+                print(f"[{i+1:2d}] ✅ RTT {latency:.2f} ms")
 
-                time.sleep(0.05)  # Small gap between packets
+            except BlockingIOError:
+                continue  # The listener thread read this datagram first
+            except Exception as e:
+                print(f"❌ receive error: {e}")
+                break
 
-        finally:
-            # Restore original timeout
-            self.socket.settimeout(original_timeout)
+        for i, _ in sent.values():
+            print(f"[{i+1:2d}] ❌ timeout - no TEST reply received")
 
         # =============== RESULTS (exclude first packet) ===============
         latencies = all_latencies[1:]  # packets 2 to 10 → 9 total
-        total_packets = len(latencies)
-        received = sum(1 for x in latencies if x is not None)
+        total_packets = latencies.size
+        received = int(np.count_nonzero(~np.isnan(latencies)))
         lost = total_packets - received
         loss_pct = (lost / total_packets) * 100 if total_packets > 0 else 0.0
 
@@ -395,26 +718,26 @@ class UDPClient(ClientBase):
 
         avg = min_latency = max_latency = None
         if received > 0:
-            valid = [x for x in latencies if x is not None]
-            avg = sum(valid) / len(valid)
-            min_latency = min(valid)
-            max_latency = max(valid)
-            print(f"   Latency - Avg: {avg:.2f} ms, Min: {min_latency:.2f} ms, Max: {max_latency:.2f} ms")
+            avg = np.nanmean(latencies)
+            min_latency = np.nanmin(latencies)
+            max_latency = np.nanmax(latencies)
+            print(f"   RTT - Avg: {avg:.2f} ms, Min: {min_latency:.2f} ms, Max: {max_latency:.2f} ms")
         else:
             print("   ❌ No successful measurements")
 
         # =============== PLOT ===============
         try:
+            # Imported here so ordinary chat sessions never pay matplotlib's startup cost
+            import matplotlib.pyplot as plt
             plt.figure(figsize=(9, 4.5))
-            seq_nums = list(range(2, 11))  # [2,3,...,10]
+            seq_nums = np.arange(2, 2 + total_packets)  # [2,3,...,10]
 
-            # Plot all points: show None as gaps (matplotlib skips NaN automatically)
-            plot_latencies = [x if x is not None else float('nan') for x in latencies]
-            plt.plot(seq_nums, plot_latencies, 'o-', color='#64b5f6', label="One-Way Latency (C→S)", linewidth=2, markersize=6)
+            # Plot all points: lost packets are NaN, which matplotlib draws as gaps
+            plt.plot(seq_nums, latencies, 'o-', color='#64b5f6', label="Round-Trip Time (C→S→C)", linewidth=2, markersize=6)
 
             plt.xlabel("Packet #", fontsize=11)
-            plt.ylabel("Latency (ms)", fontsize=11)
-            plt.title("UDP Connection Test — Latency & Loss (Excluding First Packet)", fontsize=12, fontweight='bold')
+            plt.ylabel("RTT (ms)", fontsize=11)
+            plt.title("UDP Connection Test — RTT & Loss (Excluding First Packet)", fontsize=12, fontweight='bold')
             plt.grid(True, alpha=0.4)
             plt.xticks(seq_nums)
             plt.legend()
@@ -423,7 +746,7 @@ class UDPClient(ClientBase):
             if received > 0:
                 stats_text = (f"Packets: {received}/{total_packets}\n"
                             f"Loss: {loss_pct:.1f}%\n"
-                            f"Avg: {avg:.2f} ms\n"
+                            f"Avg RTT: {avg:.2f} ms\n"
                             f"Min: {min_latency:.2f} ms\n"
                             f"Max: {max_latency:.2f} ms")
             else:
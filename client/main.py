@@ -58,11 +58,16 @@ class ChatClient:
         # Update UI
         self.connect_window.set_connecting(True, f"Connecting via {protocol}...")
         
-        # Create appropriate client based on protocol
+        # Create appropriate client based on protocol; host and port come from the
+        # connect window, the remaining tunables from ClientConfig
         if protocol.upper() == "TCP":
-            self.client = TCPClient(host, port)
+            options = ClientConfig.get_tcp_config()
+            client_class = TCPClient
         else:
-            self.client = UDPClient(host, port)
+            options = ClientConfig.get_udp_config()
+            client_class = UDPClient
+        del options["host"], options["port"]
+        self.client = client_class(host, port, **options)
         
         # Use QTimer to avoid blocking the UI thread
         QTimer.singleShot(100, self.attempt_connection)
@@ -1,30 +1,43 @@
-import socket
-import threading
+import asyncio
 import json
 import time
+from core.message_protocol import FRAME_HEADER
+
+try:
+    import orjson
+
+    # orjson parses bytes and serializes straight to bytes; its JSONDecodeError
+    # subclasses json.JSONDecodeError, so the except clauses below still match
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+try:
+    import uvloop
+
+    # libuv-backed event loop, used when installed; asyncio's own loop otherwise
+    _run = uvloop.run
+except ImportError:
+    _run = asyncio.run
 
 class SimpleTCPServer:
     def __init__(self, host='192.168.1.33', port=5050):
         self.host = host
         self.port = port
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server = None
         self.clients = []
     
-    def start(self):
-        self.socket.bind((self.host, self.port))
-        self.socket.listen(5)
+    async def start(self):
+        # Every client is a coroutine on this one event loop - no thread per connection
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port, reuse_address=True)
         print(f"TCP Server listening on {self.host}:{self.port}")
         
-        while True:
-            client_socket, address = self.socket.accept()
-            print(f"New connection from {address}")
-            self.clients.append(client_socket)
-            
-            # Start a new thread for each client
-            thread = threading.Thread(target=self.handle_client, args=(client_socket, address))
-            thread.daemon = True
-            thread.start()
+        async with self.server:
+            await self.server.serve_forever()
     
     def create_message(self, content, message_type="text", username="Server"):
         """Create a properly formatted JSON message"""
@@ -36,63 +49,55 @@ class SimpleTCPServer:
             "message_id": str(int(time.time() * 1000))
         }
     
-    def handle_client(self, client_socket, address):
-        while True:
-            try:
-                # Receive message length
-                length_data = client_socket.recv(4)
-                if not length_data:
-                    break
-                
-                message_len = int.from_bytes(length_data, byteorder='big')
+    async def handle_client(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        print(f"New connection from {address}")
+        self.clients.append(writer)
+        try:
+            while True:
+                # Length-prefixed framing: 4-byte big-endian size, then the JSON body
+                header = await reader.readexactly(4)
+                message_len = FRAME_HEADER.unpack(header)[0]
+                received_data = await reader.readexactly(message_len)
+                await self.handle_message(writer, address, received_data)
                 
-                # Receive message
-                received_data = b""
-                while len(received_data) < message_len:
-                    chunk = client_socket.recv(min(4096, message_len - len(received_data)))
-                    if not chunk:
-                        break
-                    received_data += chunk
-                
-                if received_data:
-                    message_json = received_data.decode('utf-8')
-                    print(f"Received: {message_json}")
-                    
-                    try:
-                        # Parse the incoming message
-                        message_data = json.loads(message_json)
-                        user_message = message_data.get('content', '')
-                        username = message_data.get('username', 'Unknown')
-                        
-                        # Create proper JSON response
-                        response_data = self.create_message(
-                            f"Echo: {user_message}",
-                            "text",
-                            "Server"
-                        )
-                        response_json = json.dumps(response_data)
-                        response_bytes = response_json.encode('utf-8')
-                        
-                        # Send response length first
-                        response_len = len(response_bytes)
-                        client_socket.sendall(response_len.to_bytes(4, byteorder='big'))
-                        
-                        # Send actual response
-                        client_socket.sendall(response_bytes)
-                        print(f"Sent response to {username}")
-                        
-                    except json.JSONDecodeError:
-                        print(f"Invalid JSON from {address}")
-                        
-            except Exception as e:
-                print(f"Error with client {address}: {e}")
-                break
+        except asyncio.IncompleteReadError:
+            pass  # Client closed the connection
+        except Exception as e:
+            print(f"Error with client {address}: {e}")
         
-        client_socket.close()
-        if client_socket in self.clients:
-            self.clients.remove(client_socket)
+        writer.close()
+        if writer in self.clients:
+            self.clients.remove(writer)
         print(f"Client {address} disconnected")
+    
+    async def handle_message(self, writer, address, received_data):
+        """Parse one framed message and send the echo response"""
+        print(f"Received: {received_data.decode('utf-8', 'replace')}")
+        
+        try:
+            # Parse the incoming message straight from the frame bytes
+            message_data = _loads(received_data)
+            user_message = message_data.get('content', '')
+            username = message_data.get('username', 'Unknown')
+            
+            # Create proper JSON response
+            response_data = self.create_message(
+                f"Echo: {user_message}",
+                "text",
+                "Server"
+            )
+            response_bytes = _dumps(response_data)
+            
+            # Length prefix and body in one write - one send syscall per response
+            response_len = len(response_bytes)
+            writer.write(FRAME_HEADER.pack(response_len) + response_bytes)
+            await writer.drain()
+            print(f"Sent response to {username}")
+            
+        except json.JSONDecodeError:
+            print(f"Invalid JSON from {address}")
 
 if __name__ == "__main__":
     server = SimpleTCPServer()
-    server.start()
\ No newline at end of file
+    _run(server.start())
\ No newline at end of file
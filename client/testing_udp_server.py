@@ -1,9 +1,31 @@
-import socket
-import threading
+import asyncio
 import json
 import time
 import logging
+import random
 from typing import Dict, Any
+from core.batch_send import SENDMMSG_AVAILABLE, pack_sockaddr_in, send_batch
+
+try:
+    import orjson
+
+    # orjson parses bytes and serializes straight to bytes; its JSONDecodeError
+    # subclasses json.JSONDecodeError, so the except clauses below still match
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+try:
+    import uvloop
+
+    # libuv-backed event loop, used when installed; asyncio's own loop otherwise
+    _run = uvloop.run
+except ImportError:
+    _run = asyncio.run
 
 # Setup logging
 logging.basicConfig(
@@ -12,10 +34,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class _UDPServerProtocol(asyncio.DatagramProtocol):
+    """Feeds datagrams from the event loop straight into the server's handlers"""
+    
+    def __init__(self, server: "UDPServer"):
+        self.server = server
+    
+    def datagram_received(self, data: bytes, client_addr: tuple):
+        self.server._handle_client_message(data, client_addr)
+    
+    def error_received(self, exc: Exception):
+        logger.error(f"Socket error: {exc}")
+
+
 class UDPServer:
     """
     UDP Server for testing UDP client functionality
-    Handles multiple clients simultaneously
+    Handles multiple clients simultaneously on a single asyncio event loop
     """
     
     def __init__(self, host='192.168.1.33', port=5051, buffer_size=4096):
@@ -23,61 +58,49 @@ class UDPServer:
         print(f"UDP Server will run on {self.host}:{port}")
         self.port = port
         self.buffer_size = buffer_size
-        self.socket = None
+        self.transport = None
+        self._loop = None
+        self._stopped = None  # Future that ends the serve coroutine
         self.clients = {}  # {client_address: {"username": str, "last_seen": float}}
+        self._client_addrs = ()  # Snapshot of self.clients keys, rebuilt on membership changes
         self.running = False
         self.sequence_number = 0
         
     def start(self):
         """Start the UDP server"""
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.socket.bind((self.host, self.port))
-            self.running = True
-            
-            logger.info(f"UDP Server started on {self.host}:{self.port}")
-            logger.info("Waiting for UDP clients...")
-            
-            # Start cleanup thread for inactive clients
-            cleanup_thread = threading.Thread(target=self._cleanup_clients, daemon=True)
-            cleanup_thread.start()
-            
-            # Main receive loop
-            self._receive_loop()
-            
+            _run(self._serve())
         except Exception as e:
             logger.error(f"Failed to start UDP server: {e}")
         finally:
             self.stop()
     
-    def _receive_loop(self):
-        """Main loop for receiving UDP messages"""
-        while self.running:
-            try:
-                data, client_addr = self.socket.recvfrom(self.buffer_size)
-                
-                # Handle message in a separate thread
-                client_thread = threading.Thread(
-                    target=self._handle_client_message,
-                    args=(data, client_addr),
-                    daemon=True
-                )
-                client_thread.start()
-                
-            except socket.timeout:
-                continue
-            except OSError as e:
-                if self.running:
-                    logger.error(f"Socket error: {e}")
-                break
-            except Exception as e:
-                logger.error(f"Unexpected error in receive loop: {e}")
+    async def _serve(self):
+        """Bind the endpoint and handle datagrams until stop() is called"""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = self._loop.create_future()
+        self.transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _UDPServerProtocol(self),
+            local_addr=(self.host, self.port)
+        )
+        self.running = True
+        
+        logger.info(f"UDP Server started on {self.host}:{self.port}")
+        logger.info("Waiting for UDP clients...")
+        
+        # Periodic cleanup of inactive clients, rescheduled by itself
+        self._loop.call_later(30, self._cleanup_clients)
+        
+        try:
+            await self._stopped
+        finally:
+            self.transport.close()
     
     def _handle_client_message(self, data: bytes, client_addr: tuple):
         """Handle a message from a client"""
         try:
-            message_str = data.decode('utf-8')
-            message_data = json.loads(message_str)
+            # Parsed straight from the datagram bytes, UTF-8 validated by the parser
+            message_data = _loads(data)
             
             message_type = message_data.get('type', 'message')
             content = message_data.get('content', '')
@@ -85,10 +108,16 @@ class UDPServer:
             timestamp = message_data.get('timestamp', time.time())
             
             # Update client info
-            self.clients[client_addr] = {
-                "username": username,
-                "last_seen": time.time()
-            }
+            client_info = self.clients.get(client_addr)
+            if client_info is None:
+                self.clients[client_addr] = {
+                    "username": username,
+                    "last_seen": time.time()
+                }
+                self._refresh_client_addrs()
+            else:
+                client_info["username"] = username
+                client_info["last_seen"] = time.time()
             
             logger.info(f"Received {message_type} from {username}@{client_addr}: {content}")
             
@@ -131,6 +160,7 @@ class UDPServer:
         """Handle client disconnection"""
         if client_addr in self.clients:
             del self.clients[client_addr]
+            self._refresh_client_addrs()
         
         # Notify other clients
         self._broadcast_message(
@@ -142,30 +172,29 @@ class UDPServer:
     
     def _handle_message(self, client_addr: tuple, username: str, content: str):
         """Handle regular chat message"""
-        # Echo the message back to the sender
-        echo_response = self._create_message(
-            message_type="message",
-            content=f"UDP Echo: {content}",
-            username="Server"
-        )
-        self._send_to_client(client_addr, echo_response)
-        
-        # Also broadcast to other clients (simulate multi-client chat)
-        broadcast_msg = self._create_message(
+        # One message dict for both payloads; the echo differs only in content and sender
+        message_data = self._create_message(
             message_type="message",
             content=content,
             username=username
         )
-        self._broadcast_message_data(broadcast_msg, exclude_client=client_addr)
+        echo_bytes = _dumps({**message_data, "content": f"UDP Echo: {content}", "username": "Server"})
+        
+        # Echo to the sender and broadcast to the others (simulate multi-client chat)
+        # in a single fan-out; the broadcast is only serialized if someone gets it
+        recipients = [addr for addr in self._client_addrs if addr != client_addr]
+        payloads = [echo_bytes]
+        if recipients:
+            payloads += [_dumps(message_data)] * len(recipients)
+        self._send_datagrams(payloads, [client_addr] + recipients)
         
         # Simulate UDP characteristics - occasional packet loss
-        import random
         if random.random() < 0.1:  # 10% packet loss simulation
             logger.info(f"Simulated packet loss for message from {username}")
         
         # Simulate out-of-order delivery occasionally
         if random.random() < 0.2:  # 20% chance of delayed response
-            threading.Timer(0.5, self._send_delayed_message, [client_addr, content]).start()
+            self._loop.call_later(0.5, self._send_delayed_message, client_addr, content)
     
     def _send_delayed_message(self, client_addr: tuple, original_content: str):
         """Send a delayed message to simulate UDP out-of-order delivery"""
@@ -187,22 +216,36 @@ class UDPServer:
     
     def _broadcast_message_data(self, message_data: dict, exclude_client: tuple = None):
         """Broadcast message data to all connected clients"""
-        message_json = json.dumps(message_data)
-        message_bytes = message_json.encode('utf-8')
+        message_bytes = _dumps(message_data)
+        recipients = [addr for addr in self._client_addrs if addr != exclude_client]
+        self._send_datagrams([message_bytes] * len(recipients), recipients)
+    
+    def _send_datagrams(self, payloads: list, addresses: list):
+        """Send payloads[i] to addresses[i] - one sendmmsg call where available"""
+        sent = 0
+        if SENDMMSG_AVAILABLE and len(addresses) > 1:
+            try:
+                sock = self.transport.get_extra_info('socket')
+                sent = send_batch(
+                    sock.fileno(),
+                    payloads,
+                    [pack_sockaddr_in(addr) for addr in addresses]
+                )
+            except OSError as e:
+                logger.warning(f"Batched send failed, sending individually: {e}")
         
-        for client_addr in list(self.clients.keys()):
-            if client_addr != exclude_client:
-                try:
-                    self.socket.sendto(message_bytes, client_addr)
-                except Exception as e:
-                    logger.error(f"Failed to send to {client_addr}: {e}")
+        # Whatever the batch did not cover (or everything, without sendmmsg)
+        for message_bytes, client_addr in zip(payloads[sent:], addresses[sent:]):
+            try:
+                self.transport.sendto(message_bytes, client_addr)
+            except Exception as e:
+                logger.error(f"Failed to send to {client_addr}: {e}")
     
     def _send_to_client(self, client_addr: tuple, message_data: dict):
         """Send a message to a specific client"""
         try:
-            message_json = json.dumps(message_data)
-            message_bytes = message_json.encode('utf-8')
-            self.socket.sendto(message_bytes, client_addr)
+            message_bytes = _dumps(message_data)
+            self.transport.sendto(message_bytes, client_addr)
         except Exception as e:
             logger.error(f"Failed to send to {client_addr}: {e}")
     
@@ -225,34 +268,49 @@ class UDPServer:
             "version": "1.0"
         }
     
+    def _refresh_client_addrs(self):
+        """Rebuild the address snapshot broadcasts iterate - call after adding or removing a client"""
+        self._client_addrs = tuple(self.clients)
+    
     def _cleanup_clients(self):
         """Clean up inactive clients (those who haven't sent messages in a while)"""
-        while self.running:
-            time.sleep(30)  # Check every 30 seconds
-            current_time = time.time()
-            inactive_clients = []
-            
-            for client_addr, client_info in self.clients.items():
-                if current_time - client_info["last_seen"] > 60:  # 60 seconds timeout
-                    inactive_clients.append(client_addr)
+        if not self.running:
+            return
+        current_time = time.time()
+        inactive_clients = []
+        
+        for client_addr, client_info in self.clients.items():
+            if current_time - client_info["last_seen"] > 60:  # 60 seconds timeout
+                inactive_clients.append(client_addr)
+        
+        for client_addr in inactive_clients:
+            username = self.clients[client_addr]["username"]
+            logger.info(f"Removing inactive client: {username}@{client_addr}")
+            del self.clients[client_addr]
+            self._refresh_client_addrs()
             
-            for client_addr in inactive_clients:
-                username = self.clients[client_addr]["username"]
-                logger.info(f"Removing inactive client: {username}@{client_addr}")
-                del self.clients[client_addr]
-                
-                # Notify about inactive client removal
-                self._broadcast_message(
-                    f"{username} timed out (inactive)",
-                    exclude_client=client_addr
-                )
+            # Notify about inactive client removal
+            self._broadcast_message(
+                f"{username} timed out (inactive)",
+                exclude_client=client_addr
+            )
+        
+        self._loop.call_later(30, self._cleanup_clients)  # Check every 30 seconds
+    
+    def _stop_serving(self):
+        """Runs on the event loop: let _serve() return and close the transport"""
+        if not self._stopped.done():
+            self._stopped.set_result(None)
     
     def stop(self):
         """Stop the UDP server"""
         self.running = False
-        if self.socket:
-            self.socket.close()
-            self.socket = None
+        if self._stopped is not None and not self._stopped.done():
+            try:
+                # Safe from any thread; the serve coroutine closes the transport
+                self._loop.call_soon_threadsafe(self._stop_serving)
+            except RuntimeError:
+                pass  # Event loop already closed
         logger.info("UDP Server stopped")
 
 def main():
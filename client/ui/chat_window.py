@@ -2,14 +2,23 @@ from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QTextEdit, QPushButton, QLabel, QStatusBar
 )
-from PyQt6.QtCore import Qt, pyqtSignal, QDateTime
+from PyQt6.QtCore import Qt, pyqtSignal, QDateTime, QRegularExpression
 from PyQt6.QtGui import QTextCursor, QFont
 from pathlib import Path
+from collections import deque
 
 from PyQt6.QtWidgets import QTextEdit
 from PyQt6.QtGui import QKeyEvent
 from PyQt6.QtCore import Qt
 
+# Messages kept in the chat display; the oldest are dropped past this
+MAX_SCROLLBACK_MESSAGES = 500
+
+# First non-whitespace character - found without copying the input text out
+_NON_SPACE = QRegularExpression(r"\S")
+
+_HTML_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\n": "<br>"})
+
 class MessageInput(QTextEdit):
     '''
         to add custom behavior for ENTER key
@@ -38,6 +47,57 @@ class ChatWindow(QMainWindow):
     message_sent = pyqtSignal(str)
     disconnected = pyqtSignal()
 
+    # Message bubbles; "ts" and "message" are filled in per message
+    _SYSTEM_TMPL = """
+            <div style="
+                color:#bbaaff;
+                font-style:italic;
+                margin:6px 0;
+            ">
+                [%(ts)s] %(message)s
+            </div>
+            """
+
+    # RIGHT aligned
+    _OWN_TMPL = """
+            <div style="
+                text-align:right;
+                margin:8px 0;
+                padding:6px 10px;
+                background:#35363b;
+                border-radius:6px;
+                display:inline-block;
+                float:right;
+                max-width:70%%;
+                clear:both;
+            ">
+                <span style="color:#ffffff;">[%(ts)s]</span>
+                <span style="color:#d4c5ff;">You:</span>
+                <span style="color:#ffffff;"> %(message)s</span>
+            </div>
+            <div style="clear:both;"></div>
+            """
+
+    # LEFT aligned
+    _SRV_TMPL = """
+            <div style="
+                text-align:left;
+                margin:8px 0;
+                padding:6px 10px;
+                background:#2e3035;
+                border-radius:6px;
+                display:inline-block;
+                float:left;
+                max-width:70%%;
+                clear:both;
+            ">
+                <span style="color:#ffffff;">[%(ts)s]</span>
+                <span style="color:#c6d4ff;">Server:</span>
+                <span style="color:#ffffff;"> %(message)s</span>
+            </div>
+            <div style="clear:both;"></div>
+            """
+
     def __init__(self, username, host, port, protocol):
         super().__init__()
         self.username = username
@@ -82,6 +142,10 @@ class ChatWindow(QMainWindow):
         self.chat_display.setObjectName("chatDisplay")
         self.chat_display.setReadOnly(True)
         self.chat_display.setFont(QFont("Consolas", 11))
+        # Kept at the end of the document so new messages are inserted in place
+        self._end_cursor = QTextCursor(self.chat_display.document())
+        # Blocks each displayed message spans, oldest first - a bubble is several blocks
+        self._message_blocks = deque()
         layout.addWidget(self.chat_display)
 
         # Bottom input
@@ -93,9 +157,7 @@ class ChatWindow(QMainWindow):
         self.message_input.enter_pressed.connect(self._send_msg)
         self.message_input.setMinimumHeight(32)
         self.message_input.setMaximumHeight(80)
-        self.message_input.textChanged.connect(
-            lambda: self.send_btn.setEnabled(bool(self.message_input.toPlainText().strip()))
-        )
+        self.message_input.textChanged.connect(self._update_send_enabled)
         bottom.addWidget(self.message_input)
 
         self.send_btn = QPushButton("Send")
@@ -153,66 +215,50 @@ class ChatWindow(QMainWindow):
         # DO NOT ADD MESSAGE HERE — prevent duplicates
         self.message_sent.emit(msg)
 
+    def _update_send_enabled(self):
+        document = self.message_input.document()
+        has_text = not document.isEmpty() and not document.find(_NON_SPACE).isNull()
+        self.send_btn.setEnabled(has_text)
+
     def add_message(self, message, is_own=False, is_system=False):
         ts = QDateTime.currentDateTime().toString("HH:mm")
 
-        # Escape HTML symbols
-        message = message.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-        message = message.replace("\n", "<br>")
+        # Escape HTML symbols in one pass
+        message = message.translate(_HTML_ESCAPE_TABLE)
 
         if is_system:
-            html = f"""
-            <div style="
-                color:#bbaaff;
-                font-style:italic;
-                margin:6px 0;
-            ">
-                [{ts}] {message}
-            </div>
-            """
+            template = self._SYSTEM_TMPL
         elif is_own:
-            # RIGHT aligned
-            html = f"""
-            <div style="
-                text-align:right;
-                margin:8px 0;
-                padding:6px 10px;
-                background:#35363b;
-                border-radius:6px;
-                display:inline-block;
-                float:right;
-                max-width:70%;
-                clear:both;
-            ">
-                <span style="color:#ffffff;">[{ts}]</span>
-                <span style="color:#d4c5ff;">You:</span>
-                <span style="color:#ffffff;"> {message}</span>
-            </div>
-            <div style="clear:both;"></div>
-            """
+            template = self._OWN_TMPL
         else:
-            # LEFT aligned
-            html = f"""
-            <div style="
-                text-align:left;
-                margin:8px 0;
-                padding:6px 10px;
-                background:#2e3035;
-                border-radius:6px;
-                display:inline-block;
-                float:left;
-                max-width:70%;
-                clear:both;
-            ">
-                <span style="color:#ffffff;">[{ts}]</span>
-                <span style="color:#c6d4ff;">Server:</span>
-                <span style="color:#ffffff;"> {message}</span>
-            </div>
-            <div style="clear:both;"></div>
-            """
-
-        self.chat_display.append(html)
-        self.chat_display.moveCursor(QTextCursor.MoveOperation.End)
+            template = self._SRV_TMPL
+        html = template % {"ts": ts, "message": message}
+
+        document = self.chat_display.document()
+        cursor = self._end_cursor
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        blocks_before = document.blockCount()
+        if document.isEmpty():
+            blocks_before -= 1  # The first message fills the empty block a new document has
+        else:
+            cursor.insertBlock()
+        cursor.insertHtml(html)
+        self._message_blocks.append(document.blockCount() - blocks_before)
+        self._trim_scrollback()
+
+        scrollbar = self.chat_display.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
+
+    def _trim_scrollback(self):
+        """Drop the oldest whole messages once the display holds more than MAX_SCROLLBACK_MESSAGES"""
+        excess = 0
+        while len(self._message_blocks) > MAX_SCROLLBACK_MESSAGES:
+            excess += self._message_blocks.popleft()
+        if not excess:
+            return
+        cursor = QTextCursor(self.chat_display.document())
+        cursor.movePosition(QTextCursor.MoveOperation.NextBlock, QTextCursor.MoveMode.KeepAnchor, excess)
+        cursor.removeSelectedText()
 
 
 
@@ -6,7 +6,7 @@ import ssl
 from datetime import datetime
 from typing import Callable, Dict, Any
 import time
-from server.core.message_protocol import MessageProtocol, MessageType
+from server.core.message_protocol import MessageProtocol, MessageType, FRAME_HEADER
 
 class ClientHandler:
     """Handles individual TCP client connections using length-prefixed JSON protocol
@@ -135,8 +135,7 @@ class ClientHandler:
 
                     # Process all complete messages in buffer
                     while len(buffer) >= 4:
-                        length_bytes = buffer[:4]
-                        message_len = int.from_bytes(length_bytes, 'big')
+                        message_len = FRAME_HEADER.unpack_from(buffer)[0]
                         print(f"🔍 Expected message length: {message_len} bytes")
 
                         # Safeguard: limit message size (1MB)
@@ -301,13 +300,12 @@ class ClientHandler:
             return False
 
         try:
-            encoded = MessageProtocol.encode_message(message_type, content, sender)
-            data = encoded.encode('utf-8')
+            data = MessageProtocol.encode_message_bytes(message_type, content, sender)
             length = len(data)
 
-            # Send 4-byte length (big-endian) + message
-            self.client_socket.sendall(length.to_bytes(4, 'big'))
-            self.client_socket.sendall(data)
+            # Send 4-byte length (big-endian) + message in one call: one syscall,
+            # and one TLS record when SSL is enabled
+            self.client_socket.sendall(FRAME_HEADER.pack(length) + data)
             print(f"📤 SENT | {data}")
             print(f"📤 SENT {length}B | {message_type.name}: '{content}' (sender: {sender})")
             return True
@@ -1,8 +1,19 @@
 import json
+import struct
 import time
 from typing import Dict, Any, Optional, Tuple
 from enum import Enum
 
+try:
+    import orjson
+
+    # orjson builds the UTF-8 bytes directly, with no intermediate str
+    def _dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps_bytes(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
 class MessageType(Enum):
     """Types of messages supported in the chat"""
     CONNECT = "connect"
@@ -13,12 +24,20 @@ class MessageType(Enum):
     TEST = "test"
     ACK = "ack"  # ADD THIS
 
+# 4-byte big-endian length prefix used to frame TCP messages
+FRAME_HEADER = struct.Struct(">I")
+
 class MessageProtocol:
     """Protocol for encoding and decoding chat messages."""
     
     @staticmethod
     def encode_message(message_type: MessageType, content: str, username: str) -> str:
         """Encode a message into JSON string format"""
+        return MessageProtocol.encode_message_bytes(message_type, content, username).decode("utf-8")
+    
+    @staticmethod
+    def encode_message_bytes(message_type: MessageType, content: str, username: str) -> bytes:
+        """Encode a message into compact UTF-8 JSON, ready for the socket"""
         message_data = {
             "type": message_type.value,  # Use .value instead of .name.lower()
             "content": content,
@@ -27,14 +46,24 @@ class MessageProtocol:
             "version": "1.0"
         }
         
-        return json.dumps(message_data)
+        return _dumps_bytes(message_data)
     
     @staticmethod
-    def create_ack_message(sequence: int, test_id: str = None) -> str:
-        """Create an acknowledgement message"""
-        content = json.dumps({"sequence": sequence})
+    def create_ack_message(sequence: int, test_id: str = None,
+                           ack: int = None, ack_bits: int = 0) -> str:
+        """Create an acknowledgement message
+        
+        ack/ack_bits optionally carry the receive window: ack is the highest
+        sequence seen and bit i of ack_bits marks sequence ack - 1 - i as received,
+        so one ACK also covers earlier ACKs that were lost.
+        """
+        ack_data = {"sequence": sequence}
         if test_id:
-            content = json.dumps({"sequence": sequence, "test_id": test_id})
+            ack_data["test_id"] = test_id
+        if ack is not None:
+            ack_data["ack"] = ack
+            ack_data["ack_bits"] = ack_bits
+        content = json.dumps(ack_data)
         
         return MessageProtocol.encode_message(
             MessageType.ACK,
@@ -98,6 +127,11 @@ class MessageProtocol:
     @staticmethod
     def extract_reliable_content(content: str) -> Tuple[Optional[int], str, Optional[str]]:
         """Extract sequence number and actual content from reliable message"""
+        # Only a JSON object can be an envelope, so plain chat text is not parsed a
+        # second time; the keys are looked up after parsing, so their order doesn't matter
+        if not isinstance(content, str) or not content.startswith("{"):
+            return None, content, None
+        
         try:
             data = json.loads(content)
             if "sequence" in data and "data" in data:
@@ -6,6 +6,10 @@ from server.core.server_base import ServerBase, ServerProtocol
 from server.core.message_protocol import MessageProtocol, MessageType
 import json
 
+# Reliable sequences acknowledged per ACK besides the one that triggered it
+ACK_WINDOW_BITS = 32
+_ACK_WINDOW_MASK = (1 << ACK_WINDOW_BITS) - 1
+
 class UDPServer(ServerBase):
     """UDP Server Implementation"""
 
@@ -13,6 +17,8 @@ class UDPServer(ServerBase):
         super().__init__(host, port)
         self.clients: Dict[Tuple[str, int], dict] = {}
         self.client_last_seen: Dict[Tuple[str, int], float] = {}
+        # Per-client receive window for reliable messages: [highest sequence, ack_bits]
+        self.ack_windows: Dict[Tuple[str, int], list] = {}
         self._lock = threading.RLock()
         self.receive_thread: Optional[threading.Thread] = None
         self.cleanup_thread: Optional[threading.Thread] = None
@@ -58,6 +64,7 @@ class UDPServer(ServerBase):
             disconnected_clients = list(self.clients.values())
             self.clients.clear()
             self.client_last_seen.clear()
+            self.ack_windows.clear()
         
         # Notify about disconnected clients
         for client_info in disconnected_clients:
@@ -83,11 +90,11 @@ class UDPServer(ServerBase):
                     return False
             
             # Create message using MessageProtocol
-            message_data = MessageProtocol.encode_message(
+            message_data = MessageProtocol.encode_message_bytes(
                 MessageType.MESSAGE,
                 message,
                 "server"
-            ).encode('utf-8')
+            )
             
             # Send datagram
             self.socket.sendto(message_data, client_addr)
@@ -137,7 +144,8 @@ class UDPServer(ServerBase):
                 
                 if sequence is not None:
                     # This is a reliable message, send ACK
-                    ack_msg = MessageProtocol.create_ack_message(sequence, test_id)
+                    ack, ack_bits = self._record_sequence(client_addr, sequence)
+                    ack_msg = MessageProtocol.create_ack_message(sequence, test_id, ack, ack_bits)
                     ack_data = ack_msg.encode('utf-8')
                     self.socket.sendto(ack_data, client_addr)
                     
@@ -202,11 +210,11 @@ class UDPServer(ServerBase):
         self._notify_status(f"UDP Client connected: {client_identifier}", False)
         
         # Send welcome message
-        welcome_msg = MessageProtocol.encode_message(
+        welcome_msg = MessageProtocol.encode_message_bytes(
             MessageType.STATUS,
             f"Welcome {client_name}!",
             "server"
-        ).encode('utf-8')
+        )
         self.socket.sendto(welcome_msg, client_addr)
 
     def _handle_client_disconnect(self, client_addr: Tuple[str, int]):
@@ -216,6 +224,7 @@ class UDPServer(ServerBase):
         with self._lock:
             client_info = self.clients.pop(client_addr, None)
             self.client_last_seen.pop(client_addr, None)
+            self.ack_windows.pop(client_addr, None)
         
         if client_info and hasattr(self, 'client_disconnected_callback') and self.client_disconnected_callback:
             print(f"🔴 UDP: Calling disconnect callback for {client_identifier}")
@@ -269,6 +278,23 @@ class UDPServer(ServerBase):
         except Exception as e:
             self.logger.error(f"Failed to echo TEST message: {e}")
 
+    def _record_sequence(self, client_addr: Tuple[str, int], sequence: int) -> Tuple[int, int]:
+        """Add a reliable sequence to the client's receive window - returns (ack, ack_bits)"""
+        with self._lock:
+            window = self.ack_windows.get(client_addr)
+            if window is None:
+                window = self.ack_windows[client_addr] = [sequence, 0]
+            else:
+                ack, bits = window
+                if sequence > ack:
+                    # Slide forward; the old head becomes bit (shift - 1)
+                    shift = sequence - ack
+                    window[0] = sequence
+                    window[1] = ((bits << shift) | (1 << (shift - 1))) & _ACK_WINDOW_MASK
+                elif sequence < ack and ack - sequence <= ACK_WINDOW_BITS:
+                    window[1] = bits | (1 << (ack - sequence - 1))
+            return window[0], window[1]
+    
     def _update_client_activity(self, client_addr: Tuple[str, int]):
         """Update client's last seen timestamp."""
         with self._lock: